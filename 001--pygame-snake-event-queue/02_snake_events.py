@@ -24,17 +24,28 @@ SOFTWARE.
 """
 
 import pygame
-from dataclasses import dataclass
-from typing import List, Tuple
+import numpy as np
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from timeit import default_timer as timer
+from typing import Any, Callable, Deque, Dict, FrozenSet, Hashable, Iterable, List, Optional, Sequence, Set, Tuple, Type
+import argparse
+import csv
+import json
+import logging
 import random
 
+logger = logging.getLogger("snake")
+
 # ----------------------------------------------------------------------
 # MESSAGES (EVENTS)
 # ----------------------------------------------------------------------
 
 @dataclass
 class Message:
-    pass
+    def target(self) -> Hashable:
+        """Return key of subscribers the message is meant for, or None if it is for everyone"""
+        return None
 
 @dataclass
 class SnakeChangeDirectionMessage(Message):
@@ -53,23 +64,88 @@ class EntityCollisionMessage(Message):
     entity: "Entity"
     other: "Entity"
 
+    def target(self) -> Hashable:
+        return self.entity
+
 @dataclass
 class GameOverMessage(Message):
     reason: str
 
+@dataclass
+class QuitMessage(Message):
+    pass
+
+@dataclass
+class TogglePauseMessage(Message):
+    pass
+
+Handler = Callable[[Message], List[Message]]  # handles message, returns new messages
+
+class MessageBus:
+    """
+    Delivers messages to handlers subscribed to their type
+
+    A handler can subscribe to all messages of given type, or only to those
+    with given target (see Message.target()), eg. collisions of one entity.
+    Publishing a message only calls handlers which are interested in it,
+    no matter how many other handlers there are.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[Tuple[Type[Message], Hashable], List[Handler]] = {}
+
+    def subscribe(self, message_type: Type[Message], handler: Handler, target: Hashable = None):
+        self.handlers.setdefault((message_type, target), []).append(handler)
+
+    def unsubscribe(self, message_type: Type[Message], handler: Handler, target: Hashable = None):
+        handlers = self.handlers[(message_type, target)]
+        handlers.remove(handler)
+        if not handlers:
+            del self.handlers[(message_type, target)]
+
+    def publish(self, message: Message) -> List[Message]:
+        new_messages: List[Message] = []
+        message_type = type(message)
+        for handler in self.handlers.get((message_type, None), ()):
+            new_messages.extend(handler(message))
+        target = message.target()
+        if target is not None:
+            for handler in self.handlers.get((message_type, target), ()):
+                new_messages.extend(handler(message))
+        return new_messages
+
 # ----------------------------------------------------------------------
 # ENTITIES
 # ----------------------------------------------------------------------
 
-@dataclass
+@dataclass(eq=False)  # entities are compared and hashed by identity
 class Entity:
+    grid = None  # OccupancyGrid the entity is placed in, set by World.add_entity()
+    static = False  # static entities never move and are drawn only once by IncrementalRenderer
+    layer = 0  # when entities overlap, the one on higher layer is drawn on top
+
     def render(self, surface: pygame.Surface):
-        pass
+        for position in self.get_extent():
+            surface.set_at(position, self.color_at(position))
+
+    def color_at(self, position: Tuple[int, int]) -> pygame.Color:
+        return pygame.Color("black")
 
-    def update(self, messages: List[Message]) -> List[Message]:
+    def get_pixels(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (n, 2) array of covered cells and (n, 3) array of their RGB colors"""
+        extent = list(self.get_extent())
+        positions = np.asarray(extent, dtype=int).reshape(-1, 2)
+        colors = np.asarray([tuple(self.color_at(position))[:3] for position in extent], dtype=np.uint8).reshape(-1, 3)
+        return positions, colors
+
+    def get_subscriptions(self) -> List[Tuple[Type[Message], Handler, Hashable]]:
+        """Return (message type, handler, target) for messages the entity wants to receive"""
         return []
 
-    def get_extent(self) -> List[Tuple[int, int]]:
+    def update(self) -> List[Message]:
+        return []
+
+    def get_extent(self) -> Sequence[Tuple[int, int]]:
         return []
 
     def collides_with(self, other: "Entity") -> bool:
@@ -78,175 +154,652 @@ class Entity:
         else:
             return bool(set(self.get_extent()) & set(other.get_extent()))
 
-@dataclass
+    def occupy(self, position: Tuple[int, int]):
+        if self.grid is not None:
+            self.grid.add(self, position)
+
+    def vacate(self, position: Tuple[int, int]):
+        if self.grid is not None:
+            self.grid.remove(self, position)
+
+    def repaint(self, position: Tuple[int, int]):
+        # cell looks different, but occupancy did not change
+        if self.grid is not None:
+            self.grid.dirty.add(position)
+
+@dataclass(eq=False)
 class Food(Entity):
     position: Tuple[int, int]
+    layer = 2
 
-    def render(self, surface: pygame.Surface):
-        surface.set_at(self.position, "red")
+    def color_at(self, position: Tuple[int, int]) -> pygame.Color:
+        return pygame.Color("red")
 
     def get_extent(self) -> List[Tuple[int, int]]:
         return [self.position]
 
-@dataclass
+@dataclass(eq=False)
 class Wall(Entity):
     positions: List[Tuple[int, int]]
+    static = True
+    layer = 1
 
-    def render(self, surface: pygame.Surface):
-        for position in self.positions:
-            x, y = position
-            if (x + y) % 2 == 0:
-                surface.set_at(position, (100, 100, 100))
-            else:
-                surface.set_at(position, (120, 120, 120))
+    pixels = None  # cached result of get_pixels(), walls never change
+
+    def __post_init__(self):
+        # corners are often listed twice, which would make the wall collide with itself
+        self.positions = list(dict.fromkeys(self.positions))
+
+    def color_at(self, position: Tuple[int, int]) -> pygame.Color:
+        x, y = position
+        if (x + y) % 2 == 0:
+            return pygame.Color(100, 100, 100)
+        else:
+            return pygame.Color(120, 120, 120)
+
+    def get_pixels(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self.pixels is None:
+            self.pixels = super(Wall, self).get_pixels()
+        return self.pixels
 
     def get_extent(self) -> List[Tuple[int, int]]:
         return self.positions
 
-@dataclass
+@dataclass(eq=False)
 class Snake(Entity):
-    body: List[Tuple[int, int]]  # [head, ..., tail]
+    body: Deque[Tuple[int, int]]  # [head, ..., tail]
     direction: Tuple[int, int]  # (1, 0) or such
     max_length: int
+    cells: Dict[Tuple[int, int], int] = field(init=False, repr=False, compare=False)  # cell -> how many times body covers it
+    overlaps: int = field(init=False, repr=False, compare=False)  # number of cells covered more than once
+
+    def __post_init__(self):
+        # keep body in a deque and count covered cells, so that moving and
+        # detecting self-collision takes constant time regardless of snake length
+        self.body = deque(self.body)
+        self.cells = Counter()
+        self.overlaps = 0
+        for position in self.body:
+            self.cover(position)
+
+    def cover(self, position: Tuple[int, int]):
+        self.cells[position] += 1
+        if self.cells[position] == 2:
+            self.overlaps += 1
+        self.occupy(position)
+
+    def uncover(self, position: Tuple[int, int]):
+        self.cells[position] -= 1
+        if self.cells[position] == 1:
+            self.overlaps -= 1
+        elif self.cells[position] == 0:
+            del self.cells[position]
+        self.vacate(position)
+
+    BODY_COLOR = (0, 255, 0)
+    HEAD_COLOR = (0, 200, 0)  # make head slightly darker
+
+    def color_at(self, position: Tuple[int, int]) -> pygame.Color:
+        if position == self.body[0]:
+            return pygame.Color(*self.HEAD_COLOR)
+        else:
+            return pygame.Color(*self.BODY_COLOR)
+
+    def get_pixels(self) -> Tuple[np.ndarray, np.ndarray]:
+        positions = np.asarray(self.body, dtype=int)
+        colors = np.empty((len(positions), 3), dtype=np.uint8)
+        colors[:] = self.BODY_COLOR
+        colors[0] = self.HEAD_COLOR
+        return positions, colors
+
+    def get_subscriptions(self) -> List[Tuple[Type[Message], Handler, Hashable]]:
+        return [(SnakeChangeDirectionMessage, self.on_change_direction, None),
+                (EntityCollisionMessage, self.on_collision, self)]
+
+    def on_change_direction(self, message: SnakeChangeDirectionMessage) -> List[Message]:
+        # make sure we don't allow changing to opposite direction, which would self-collide our hero
+        if any(x+y != 0 for x, y in zip(message.direction, self.direction)):
+            self.direction = message.direction
+        return []
 
-    def render(self, surface: pygame.Surface):
-        for i, position in enumerate(self.body):
-            if i == 0:
-                surface.set_at(position, (0, 200, 0))  # make head slightly darker
-            else:
-                surface.set_at(position, (0, 255, 0))
-
-    def update(self, messages: List[Message]) -> List[Message]:
-        new_messages = []
-
-        # handle events
-        for message in messages:
-            if isinstance(message, SnakeChangeDirectionMessage):
-                # make sure we don't allow changing to opposite direction, which would self-collide our hero
-                if any(x+y != 0 for x, y in zip(message.direction, self.direction)):
-                    self.direction = message.direction
-            elif isinstance(message, EntityCollisionMessage) and message.entity is self:
-                if message.other is self:
-                    new_messages.append(GameOverMessage("Snake bit its tail"))
-                elif isinstance(message.other, Wall):
-                    new_messages.append(GameOverMessage("Snake hit wall"))
-                elif isinstance(message.other, Food):
-                    self.max_length += 1
-                    new_messages.append(RemoveEntityMessage(message.other))
-                    new_messages.append(SpawnFoodMessage())
+    def on_collision(self, message: EntityCollisionMessage) -> List[Message]:
+        if message.other is self:
+            return [GameOverMessage("Snake bit its tail")]
+        elif isinstance(message.other, Wall):
+            return [GameOverMessage("Snake hit wall")]
+        elif isinstance(message.other, Food):
+            self.max_length += 1
+            return [RemoveEntityMessage(message.other), SpawnFoodMessage()]
+        return []
 
+    def update(self) -> List[Message]:
         # move snake
         old_head = self.body[0]
         new_head = (old_head[0] + self.direction[0],
                     old_head[1] + self.direction[1])
-        self.body.insert(0, new_head)
+        self.body.appendleft(new_head)
+        self.cover(new_head)
+        self.repaint(old_head)  # no longer the head
 
         while len(self.body) > self.max_length:
-            self.body.pop()
+            self.uncover(self.body.pop())
 
-        return new_messages
+        return []
 
-    def get_extent(self) -> List[Tuple[int, int]]:
+    def get_extent(self) -> Sequence[Tuple[int, int]]:
         return self.body
 
     def collides_with(self, other: "Entity") -> bool:
         if other is self:
-            return len(set(self.body)) != len(self.body)  # detect snake self-collision
+            return self.overlaps > 0  # detect snake self-collision
         else:
             return super(Snake, self).collides_with(other)  # defer to default implementation
 
+# ----------------------------------------------------------------------
+# SPATIAL INDEX
+# ----------------------------------------------------------------------
+
+class OccupancyGrid:
+    """
+    Maps cells to the entities which occupy them
+
+    Entities report every cell they enter or leave, so the grid is always
+    up to date and collisions can be found by only looking at cells
+    which are occupied more than once, instead of checking all entity pairs.
+
+    The grid also keeps a list of free cells within the board, so that a random
+    empty cell can be picked in constant time, however crowded the board is.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.cells: Dict[Tuple[int, int], List[Entity]] = {}
+        self.crowded: Set[Tuple[int, int]] = set()  # cells with more than one occupant
+        self.free: List[Tuple[int, int]] = [(x, y) for y in range(height) for x in range(width)]
+        self.free_index: Dict[Tuple[int, int], int] = {position: i for i, position in enumerate(self.free)}
+        self.dirty: Set[Tuple[int, int]] = set()  # cells changed since last IncrementalRenderer.render()
+
+    def add(self, entity: Entity, position: Tuple[int, int]):
+        self.dirty.add(position)
+        occupants = self.cells.setdefault(position, [])
+        occupants.append(entity)
+        if len(occupants) == 1:
+            self.take_free(position)
+        else:
+            self.crowded.add(position)
+
+    def remove(self, entity: Entity, position: Tuple[int, int]):
+        self.dirty.add(position)
+        occupants = self.cells[position]
+        occupants.remove(entity)
+        if len(occupants) < 2:
+            self.crowded.discard(position)
+        if not occupants:
+            del self.cells[position]
+            self.release_free(position)
+
+    def take_free(self, position: Tuple[int, int]):
+        i = self.free_index.pop(position, None)
+        if i is None:
+            return  # outside of the board
+        # move last free cell into the gap, so that the list stays without holes
+        last = self.free.pop()
+        if last != position:
+            self.free[i] = last
+            self.free_index[last] = i
+
+    def release_free(self, position: Tuple[int, int]):
+        x, y = position
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.free_index[position] = len(self.free)
+            self.free.append(position)
+
+    def random_free_cell(self, rng: random.Random) -> Optional[Tuple[int, int]]:
+        if not self.free:
+            return None
+        return self.free[rng.randrange(len(self.free))]
+
+    def collisions(self) -> List[Tuple[Entity, Entity]]:
+        """Return colliding entity pairs, (entity, entity) means self-collision"""
+        pairs: Dict[FrozenSet[Entity], Tuple[Entity, Entity]] = {}
+        for position in sorted(self.crowded):  # sorted, so that order of collisions is deterministic
+            occupants = self.cells[position]
+            for i in range(len(occupants)):
+                for j in range(i+1, len(occupants)):
+                    a, b = occupants[i], occupants[j]
+                    pairs.setdefault(frozenset((a, b)), (a, b))  # entities may overlap in many cells
+        return list(pairs.values())
+
+# ----------------------------------------------------------------------
+# INPUT SOURCES
+# ----------------------------------------------------------------------
+
+class InputSource:
+    """
+    Produces messages from outside of the world (player input, window events)
+
+    World polls its input source once per tick. Subclass this to drive the game
+    from something else than the keyboard, eg. an AI agent; this base class
+    produces no input at all.
+    """
+
+    def poll(self) -> List[Message]:
+        return []
+
+class KeyboardInputSource(InputSource):
+    KEY_BINDINGS = {  # key -> direction
+        pygame.K_UP: (0, -1),
+        pygame.K_DOWN: (0, 1),
+        pygame.K_RIGHT: (1, 0),
+        pygame.K_LEFT: (-1, 0),
+    }
+
+    def poll(self) -> List[Message]:
+        messages: List[Message] = []
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                messages.append(QuitMessage())
+            elif event.type == pygame.KEYDOWN:
+                if event.key in self.KEY_BINDINGS:
+                    messages.append(SnakeChangeDirectionMessage(self.KEY_BINDINGS[event.key]))
+                elif event.key == pygame.K_p:
+                    messages.append(TogglePauseMessage())
+        return messages
+
+class ScriptedInputSource(InputSource):
+    """Plays back given messages, one list per tick, then produces no more input"""
+
+    def __init__(self, ticks: Iterable[List[Message]]):
+        self.ticks = iter(ticks)
+
+    def poll(self) -> List[Message]:
+        return next(self.ticks, [])
+
+# ----------------------------------------------------------------------
+# PROFILING
+# ----------------------------------------------------------------------
+
+PHASES = ["input", "collisions", "delivery", "entities", "world"]  # parts of World.update()
+INPUT, COLLISIONS, DELIVERY, ENTITIES, WORLD = range(len(PHASES))
+
+class Profiler:
+    """
+    Receives measurements from World.update()
+
+    The world calls begin_tick(), then end_phase() after each of PHASES
+    (phases skipped when the game is paused or quit are left out),
+    count_messages() with all messages handled during the tick and end_tick().
+    This base class ignores everything, so that it costs next to nothing.
+    """
+
+    def begin_tick(self, tick: int):
+        pass
+
+    def end_phase(self, phase: int):
+        pass
+
+    def count_messages(self, messages: Iterable[Message]):
+        pass
+
+    def end_tick(self, n_entities: int):
+        pass
+
+class TickProfiler(Profiler):
+    """
+    Records phase timings, message counts and number of entities for the last `capacity` ticks
+
+    The data go into preallocated arrays used as a ring buffer, so that profiling
+    takes a few timer calls per tick and memory stays bounded however long the game runs.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.n_ticks = 0  # ticks recorded so far, including those already overwritten
+        self.ticks = np.zeros(capacity, dtype=np.int64)
+        self.timings = np.zeros((capacity, len(PHASES)), dtype=np.float64)  # seconds
+        self.entity_counts = np.zeros(capacity, dtype=np.int64)
+        self.message_counts: List[Counter] = [Counter() for _ in range(capacity)]  # message type -> count
+        self.row = 0
+        self.last_time = 0.0
+
+    def begin_tick(self, tick: int):
+        self.row = self.n_ticks % self.capacity
+        self.ticks[self.row] = tick
+        self.timings[self.row] = 0.0
+        self.message_counts[self.row].clear()
+        self.last_time = timer()
+
+    def end_phase(self, phase: int):
+        now = timer()
+        self.timings[self.row, phase] = now - self.last_time
+        self.last_time = now
+
+    def count_messages(self, messages: Iterable[Message]):
+        self.message_counts[self.row].update(map(type, messages))
+
+    def end_tick(self, n_entities: int):
+        self.entity_counts[self.row] = n_entities
+        self.n_ticks += 1
+
+    def rows(self, n_last: Optional[int] = None) -> np.ndarray:
+        """Return buffer indices of recorded ticks (or `n_last` of them), oldest first"""
+        n = min(self.n_ticks, self.capacity if n_last is None else min(n_last, self.capacity))
+        return np.arange(self.n_ticks - n, self.n_ticks) % self.capacity
+
+    def records(self) -> List[Dict[str, Any]]:
+        records = []
+        for row in self.rows():
+            record: Dict[str, Any] = {"tick": int(self.ticks[row])}
+            for phase, seconds in zip(PHASES, self.timings[row]):
+                record[f"{phase}_ms"] = 1e3 * seconds
+            record["total_ms"] = 1e3 * self.timings[row].sum()
+            record["entities"] = int(self.entity_counts[row])
+            record["messages"] = {t.__name__: n for t, n in self.message_counts[row].items()}
+            records.append(record)
+        return records
+
+    def save(self, path: str):
+        """Write recorded ticks into JSON file (if path ends with .json) or CSV file"""
+        records = self.records()
+        if path.endswith(".json"):
+            with open(path, "w") as fp:
+                json.dump(records, fp, indent=1)
+            return
+
+        message_types = sorted({name for record in records for name in record["messages"]})
+        with open(path, "w", newline="") as fp:
+            writer = csv.writer(fp)
+            columns = [column for column in records[0] if column != "messages"] if records else ["tick"]
+            writer.writerow(columns + message_types)
+            for record in records:
+                writer.writerow([record[column] for column in columns] +
+                                [record["messages"].get(name, 0) for name in message_types])
+
+    def summary(self, n_last: int = 100) -> List[str]:
+        """Return text lines with averages over last ticks, eg. for on-screen overlay"""
+        rows = self.rows(n_last)
+        if len(rows) == 0:
+            return []
+        timings = 1e3 * self.timings[rows].mean(axis=0)
+        messages: Counter = Counter()
+        for row in rows:
+            messages.update(self.message_counts[row])
+        return [f"{timings.sum():.3f} ms/tick, {self.entity_counts[rows[-1]]} entities (last {len(rows)} ticks)",
+                " ".join(f"{phase} {t:.3f}" for phase, t in zip(PHASES, timings)),
+                " ".join(f"{t.__name__.replace('Message', '')} {n/len(rows):.2f}" for t, n in messages.most_common(4))]
+
 # ----------------------------------------------------------------------
 # MAIN LOGIC
 # ----------------------------------------------------------------------
 
 class World:
-    def __init__(self, surface: pygame.Surface):
-        self.width: int = surface.get_width()
-        self.height: int = surface.get_height()
-        self.surface = surface
+    def __init__(self, width: int, height: int, surface: Optional[pygame.Surface] = None,
+                 input_source: Optional[InputSource] = None, seed: Optional[int] = None,
+                 profiler: Optional[Profiler] = None):
+        self.width = width
+        self.height = height
+        self.surface = surface  # None for headless simulation
+        self.input_source = input_source if input_source is not None else InputSource()
+        self.rng = random.Random(seed)
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.tick = 0
         self.entities: List[Entity] = []
+        self.grid = OccupancyGrid(width, height)
+        self.bus = MessageBus()  # delivers messages to entities
+        self.world_bus = MessageBus()  # delivers messages to the world itself
         self.message_queue: List[Message] = []
         self.running = True
         self.paused = False
 
+        self.world_bus.subscribe(GameOverMessage, self.on_game_over)
+        self.world_bus.subscribe(RemoveEntityMessage, self.on_remove_entity)
+        self.world_bus.subscribe(SpawnFoodMessage, self.on_spawn_food)
+
+    def add_entity(self, entity: Entity):
+        self.entities.append(entity)
+        entity.grid = self.grid
+        for position in entity.get_extent():
+            self.grid.add(entity, position)
+        for message_type, handler, target in entity.get_subscriptions():
+            self.bus.subscribe(message_type, handler, target)
+
+    def remove_entity(self, entity: Entity):
+        if entity.grid is not self.grid:
+            return  # already removed, eg. snake which hit the wall and another snake at the same time
+
+        self.entities.remove(entity)
+        for position in entity.get_extent():
+            self.grid.remove(entity, position)
+        for message_type, handler, target in entity.get_subscriptions():
+            self.bus.unsubscribe(message_type, handler, target)
+        entity.grid = None
+
     def render(self):
-        for entity in self.entities:
-            entity.render(self.surface)
+        if self.surface is None:
+            return
+
+        render_entities(self.surface, self.entities)
+
+    def run(self, n_ticks: int) -> int:
+        """Update the world as fast as possible, without rendering; return number of ticks done"""
+        for i in range(n_ticks):
+            if not self.running:
+                return i
+            self.update()
+        return n_ticks
+
+    def on_game_over(self, message: GameOverMessage) -> List[Message]:
+        logger.info("game over at tick %d: %s", self.tick, message.reason)
+        self.running = False
+        return []
+
+    def on_remove_entity(self, message: RemoveEntityMessage) -> List[Message]:
+        self.remove_entity(message.entity)
+        return []
+
+    def on_spawn_food(self, message: SpawnFoodMessage) -> List[Message]:
+        position = self.grid.random_free_cell(self.rng)
+        if position is None:
+            raise RuntimeError("Failed to put food into empty space")
+
+        self.add_entity(Food(position=position))
+        return []
 
     def update(self):
-        pygame_events = pygame.event.get()
+        self.tick += 1
+        self.profiler.begin_tick(self.tick)
+        self.update_phases()
+        self.profiler.end_tick(len(self.entities))
 
+    def update_phases(self):
         # handle outside events
-        for event in pygame_events:
-            if event.type == pygame.QUIT:
+        for message in self.input_source.poll():
+            if isinstance(message, QuitMessage):
+                logger.info("quit at tick %d", self.tick)
                 self.running = False
                 return
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_UP:
-                    self.message_queue.append(SnakeChangeDirectionMessage((0, -1)))
-                elif event.key == pygame.K_DOWN:
-                    self.message_queue.append(SnakeChangeDirectionMessage((0, 1)))
-                elif event.key == pygame.K_RIGHT:
-                    self.message_queue.append(SnakeChangeDirectionMessage((1, 0)))
-                elif event.key == pygame.K_LEFT:
-                    self.message_queue.append(SnakeChangeDirectionMessage((-1, 0)))
-                elif event.key == pygame.K_p:
-                    self.paused = not self.paused  # toggle pause
+            elif isinstance(message, TogglePauseMessage):
+                self.paused = not self.paused
+            else:
+                self.message_queue.append(message)
+
+        self.profiler.end_phase(INPUT)
 
         if self.paused:
             self.message_queue.clear()
             return
 
         # handle collisions
-        for i in range(len(self.entities)):
-            for j in range(i, len(self.entities)):
-                if self.entities[i].collides_with(self.entities[j]):
-                    self.message_queue.append(EntityCollisionMessage(self.entities[i], self.entities[j]))
-                    self.message_queue.append(EntityCollisionMessage(self.entities[j], self.entities[i]))
+        for a, b in self.grid.collisions():
+            self.message_queue.append(EntityCollisionMessage(a, b))
+            if a is not b:
+                self.message_queue.append(EntityCollisionMessage(b, a))
+        self.profiler.end_phase(COLLISIONS)
 
-        # update entities
+        # deliver messages to entities which subscribed to them
         new_messages: List[Message] = []
 
+        for message in self.message_queue:
+            new_messages.extend(self.bus.publish(message))
+        self.profiler.end_phase(DELIVERY)
+
+        # update entities
         for entity in self.entities:
-            tmp = entity.update(self.message_queue)
+            tmp = entity.update()
             new_messages.extend(tmp)
 
+        self.profiler.end_phase(ENTITIES)
+
         # handle global messages, clear queue
         self.message_queue.extend(new_messages)
+        log_messages = logger.isEnabledFor(logging.DEBUG)  # checked once, the loop is hot
 
         for message in self.message_queue:
-            print(message)  # XXX
+            if log_messages:
+                logger.debug("tick %d: %s", self.tick, message)
 
-            if isinstance(message, GameOverMessage):
-                self.running = False
-                return
-            elif isinstance(message, RemoveEntityMessage):
-                self.entities.remove(message.entity)
-            elif isinstance(message, SpawnFoodMessage):
-                for _ in range(100):
-                    new_food = Food(position=(random.randrange(self.width), random.randrange(self.height)))
-                    ok = True
-                    for entity in self.entities:
-                        if entity.collides_with(new_food):
-                            ok = False
-                            break
-                    if ok:
-                        break
-                else:
-                    raise RuntimeError("Failed to put food into empty space")
-
-                self.entities.append(new_food)
+            # messages produced by world handlers are appended and handled in this loop, too
+            self.message_queue.extend(self.world_bus.publish(message))
+            if not self.running:
+                break
 
+        self.profiler.end_phase(WORLD)
+        self.profiler.count_messages(self.message_queue)
         self.message_queue.clear()
 
 
-def main():
+# ----------------------------------------------------------------------
+# RENDERING
+# ----------------------------------------------------------------------
+
+def render_entities(surface: pygame.Surface, entities: Iterable[Entity]):
+    """Draw entities with one array assignment per layer, instead of calling surface.set_at() for every cell"""
+    layers: Dict[int, List[Tuple[np.ndarray, np.ndarray]]] = {}
+    for entity in entities:
+        layers.setdefault(entity.layer, []).append(entity.get_pixels())
+
+    width, height = surface.get_size()
+    pixels = pygame.surfarray.pixels3d(surface)  # (width, height, 3) view, locks the surface
+    for layer in sorted(layers):
+        positions = np.concatenate([positions for positions, _ in layers[layer]])
+        colors = np.concatenate([colors for _, colors in layers[layer]])
+        x, y = positions[:, 0], positions[:, 1]
+        inside = (0 <= x) & (x < width) & (0 <= y) & (y < height)
+        pixels[x[inside], y[inside]] = colors[inside]
+    del pixels  # unlock the surface
+
+class TextCache:
+    """Renders text with given font, reusing the rendered surface while the text stays the same"""
+
+    def __init__(self, font: pygame.font.Font, color: Tuple[int, int, int] = (0, 0, 0), max_size: int = 64):
+        self.font = font
+        self.color = color
+        self.max_size = max_size
+        self.surfaces: Dict[str, pygame.Surface] = {}
+
+    def render(self, text: str) -> pygame.Surface:
+        surface = self.surfaces.get(text)
+        if surface is None:
+            if len(self.surfaces) >= self.max_size:
+                self.surfaces.clear()
+            surface = self.surfaces[text] = self.font.render(text, True, self.color)
+        return surface
+
+class IncrementalRenderer:
+    """
+    Draws the world on display, updating only cells which changed since last frame
+
+    Static entities (walls) are drawn into the background once. Every frame, only
+    dirty cells of the occupancy grid are redrawn in low resolution and their
+    scaled rectangles are pushed to the screen with pygame.display.update(rects),
+    together with any text overlays.
+    """
+
+    def __init__(self, world: World, display: pygame.Surface, scale: int):
+        self.world = world
+        self.display = display
+        self.scale = scale
+        self.surface = world.surface  # low resolution copy of the whole board
+        self.background = pygame.Surface((world.width, world.height))
+        self.background.fill("white")
+        render_entities(self.background, [entity for entity in world.entities if entity.static])
+        self.overlays: List[Tuple[pygame.Surface, Tuple[int, int]]] = []
+        self.redraw_all()
+
+    def redraw_all(self):
+        self.surface.blit(self.background, (0, 0))
+        render_entities(self.surface, [entity for entity in self.world.entities if not entity.static])
+        self.world.grid.dirty.clear()
+        self.display.blit(pygame.transform.scale(self.surface, self.display.get_rect().size), (0, 0))
+        for text, position in self.overlays:
+            self.display.blit(text, position)
+        pygame.display.flip()
+
+    def render(self, overlays: List[Tuple[pygame.Surface, Tuple[int, int]]]):
+        """Draw changes since last frame, with given (text surface, position) on top"""
+        rects: List[pygame.Rect] = []
+        occupied = self.world.grid.cells
+
+        for position in self.world.grid.dirty:
+            x, y = position
+            if not (0 <= x < self.world.width and 0 <= y < self.world.height):
+                continue
+            color = self.background.get_at(position)
+            top = max(occupied.get(position, ()), key=lambda entity: entity.layer, default=None)
+            if top is not None:
+                color = top.color_at(position)
+            self.surface.set_at(position, color)
+            rect = pygame.Rect(x*self.scale, y*self.scale, self.scale, self.scale)
+            self.display.fill(color, rect)
+            rects.append(rect)
+        self.world.grid.dirty.clear()
+
+        if overlays != self.overlays or any(rect.collidelist(rects) != -1 for rect in self.overlay_rects()):
+            # uncover board under old overlays, then draw the new ones
+            for rect in self.overlay_rects():
+                self.restore(rect)
+                rects.append(rect)
+            self.overlays = list(overlays)
+            for text, position in self.overlays:
+                rects.append(self.display.blit(text, position))
+
+        pygame.display.update(rects)
+
+    def overlay_rects(self) -> List[pygame.Rect]:
+        return [text.get_rect(topleft=position) for text, position in self.overlays]
+
+    def restore(self, rect: pygame.Rect):
+        # scale covered part of the low resolution board back onto the display
+        s = self.scale
+        area = pygame.Rect(rect.x // s, rect.y // s, rect.right // s - rect.x // s + 1, rect.bottom // s - rect.y // s + 1)
+        area = area.clip(self.surface.get_rect())
+        scaled = pygame.transform.scale(self.surface.subsurface(area), (area.w * s, area.h * s))
+        self.display.blit(scaled, (area.x * s, area.y * s))
+
+
+def setup_world(world: World) -> Snake:
+    """Put snake, walls and first food into an empty world, return the snake"""
+    snake = Snake(body=[(10, 10), (9, 10), (8, 10)], direction=(1, 0), max_length=3)
+    wall = Wall([(x, 0) for x in range(world.width)] + [(x, world.height-1) for x in range(world.width)] +
+                [(0, x) for x in range(world.height)] + [(world.width-1, x) for x in range(world.height)])
+    world.add_entity(snake)
+    world.add_entity(wall)
+    world.message_queue.append(SpawnFoodMessage())
+    world.update()
+    assert not world.grid.collisions(), "entities overlap in a fresh world"
+    return snake
+
+
+def main(profiler: Optional[TickProfiler] = None):
     WIDTH, HEIGHT = 120, 80
     SCALE = 8
 
     pygame.init()
     pygame.font.init()
     font = pygame.font.SysFont('Ubuntu Sans', 30)
+    texts = TextCache(font)
+    stats_texts = TextCache(pygame.font.SysFont('Ubuntu Mono', 16))
 
     pygame.display.set_caption("Snake game")
     display = pygame.display.set_mode((SCALE*WIDTH, SCALE*HEIGHT))  # actual game window
@@ -254,31 +807,24 @@ def main():
     clock = pygame.time.Clock()
 
     # prepare world
-    world = World(surface)
-    snake = Snake(body=[(10, 10), (9, 10), (8, 10)], direction=(1, 0), max_length=3)
-    wall = Wall([(x, 0) for x in range(WIDTH)] + [(x, HEIGHT-1) for x in range(WIDTH)] +
-                [(0, x) for x in range(HEIGHT)] + [(WIDTH-1, x) for x in range(HEIGHT)])
-    world.entities.append(snake)
-    world.entities.append(wall)
-    world.message_queue.append(SpawnFoodMessage())
-    world.update()
+    world = World(WIDTH, HEIGHT, surface=surface, input_source=KeyboardInputSource(), profiler=profiler)
+    snake = setup_world(world)
+    renderer = IncrementalRenderer(world, display, SCALE)
 
     # for every frame
     while world.running:
         # handle game logic
         world.update()
 
-        # render in low resolution
-        surface.fill("white")
-        world.render()
-
-        # render in high resolution
-        display.blit(pygame.transform.scale(surface, display.get_rect().size), (0, 0))
-        display.blit(font.render(f"Snake Length: {snake.max_length}", True, (0, 0, 0)), (10, 10))
+        # render cells which changed, with text on top
+        overlays = [(texts.render(f"Snake Length: {snake.max_length}"), (10, 10))]
         if world.paused:
-            text = font.render(f"PAUSE (press P to continue)", True, (0, 0, 0))
-            display.blit(text, ((SCALE * WIDTH - text.get_width()) / 2, (SCALE * HEIGHT - text.get_height()) / 2))
-        pygame.display.flip()
+            text = texts.render(f"PAUSE (press P to continue)")
+            overlays.append((text, ((SCALE * WIDTH - text.get_width()) // 2, (SCALE * HEIGHT - text.get_height()) // 2)))
+        if profiler is not None:
+            for i, line in enumerate(reversed(profiler.summary())):
+                overlays.append((stats_texts.render(line), (15, SCALE*HEIGHT - 30 - 20*i)))
+        renderer.render(overlays)
 
         # wait till next frame
         default_speed = 10  # fps
@@ -300,4 +846,13 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--profile", metavar="PATH", help="show tick statistics, save them into CSV or JSON file")
+    parser.add_argument("--log-level", default="WARNING", help="eg. INFO for game events, DEBUG for all messages")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(message)s")
+
+    profiler = TickProfiler() if args.profile else None
+    main(profiler=profiler)
+    if profiler is not None:
+        profiler.save(args.profile)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Vectorized Snake engine (many games at once in NumPy arrays)
+
+Copyright (c) 2021 Tomas Karabela
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import numpy as np
+from timeit import default_timer as timer
+from typing import Optional, Tuple
+
+# actions, in the same order as arrow keys in 02_snake_events.py
+UP, DOWN, RIGHT, LEFT = range(4)
+NO_ACTION = -1
+DIRECTIONS = np.asarray([(0, -1), (0, 1), (1, 0), (-1, 0)], dtype=np.int64)  # action -> (dx, dy)
+
+# cell values in BatchedSnakeWorld.observe()
+EMPTY, WALL, BODY, HEAD, FOOD = range(5)
+
+
+class BatchedSnakeWorld:
+    """
+    N independent single-player Snake games, advanced together by one step() call
+
+    There are no entity objects; each world is described by arrays indexed by world:
+    head position, direction, body length, food position and an occupancy grid.
+    The grid stores the tick at which the head entered each cell. Since the snake
+    moves by exactly one cell per tick, a cell belongs to the body iff it was entered
+    during the last `length` ticks, so the tail never has to be tracked explicitly.
+
+    The rules are the same as in World.update() from 02_snake_events.py, including
+    the order of events within a tick:
+
+    1. collisions are checked for the current state: snake which hit the wall
+       or bit its tail ends its game, snake with head on food eats it
+    2. snake turns (turning back is ignored), grows if it has eaten and moves
+    3. eaten food is respawned on a random empty cell
+
+    The only difference is that a finished world does not move its snake
+    one more time (World.update() stops only after snakes have moved).
+    """
+
+    def __init__(self, n_worlds: int, width: int = 120, height: int = 80, seed: Optional[int] = None):
+        self.n_worlds = n_worlds
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed)
+
+        self.wall = np.zeros((height, width), dtype=bool)
+        self.wall[[0, -1], :] = True
+        self.wall[:, [0, -1]] = True
+
+        self.entered = np.zeros((n_worlds, height, width), dtype=np.int32)  # tick when head entered the cell
+        self.tick = np.zeros(n_worlds, dtype=np.int32)  # ticks played in each world
+        self.head = np.zeros((n_worlds, 2), dtype=np.int64)  # (x, y)
+        self.direction = np.zeros((n_worlds, 2), dtype=np.int64)  # (dx, dy)
+        self.length = np.zeros(n_worlds, dtype=np.int32)
+        self.max_length = np.zeros(n_worlds, dtype=np.int32)
+        self.food = np.zeros((n_worlds, 2), dtype=np.int64)  # (x, y)
+        self.bitten = np.zeros(n_worlds, dtype=bool)  # head moved onto body during last tick
+        self.done = np.zeros(n_worlds, dtype=bool)
+
+        self.reset()
+
+    def reset(self, mask: Optional[np.ndarray] = None):
+        """Start new games in given worlds (all worlds by default)"""
+        idx = np.arange(self.n_worlds) if mask is None else np.flatnonzero(mask)
+
+        # same starting position as setup_world(): body [(10, 10), (9, 10), (8, 10)], heading right
+        self.tick[idx] = 3
+        self.entered[idx] = np.iinfo(np.int32).min // 2  # "long ago", ie. not part of the body
+        self.entered[idx, 10, 8] = 1
+        self.entered[idx, 10, 9] = 2
+        self.entered[idx, 10, 10] = 3
+        self.head[idx] = (10, 10)
+        self.direction[idx] = (1, 0)
+        self.length[idx] = 3
+        self.max_length[idx] = 3
+        self.bitten[idx] = False
+        self.done[idx] = False
+        self.spawn_food(idx)
+
+    def body_mask(self) -> np.ndarray:
+        """Boolean (N, height, width) array of cells covered by snakes"""
+        return self.entered > (self.tick - self.length)[:, None, None]
+
+    def observe(self) -> np.ndarray:
+        """Return (N, height, width) array of EMPTY, WALL, BODY, HEAD and FOOD values"""
+        obs = np.where(self.body_mask(), BODY, EMPTY).astype(np.uint8)
+        obs[:, self.wall] = WALL
+        idx = np.arange(self.n_worlds)
+        obs[idx, self.food[:, 1], self.food[:, 0]] = FOOD
+        obs[idx, self.head[:, 1], self.head[:, 0]] = HEAD
+        return obs
+
+    def spawn_food(self, idx: np.ndarray):
+        """Put food on a uniformly random empty cell of given worlds"""
+        if len(idx) == 0:
+            return
+        body = self.entered[idx] > (self.tick[idx] - self.length[idx])[:, None, None]
+        free = ~(body | self.wall)
+        # argmax of random scores over free cells = random free cell, for all worlds at once
+        scores = self.rng.random(free.shape, dtype=np.float32)
+        scores[~free] = -1
+        cell = scores.reshape(len(idx), -1).argmax(axis=1)
+        self.food[idx, 0] = cell % self.width
+        self.food[idx, 1] = cell // self.width
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Advance all worlds by one tick
+
+        `actions` holds one of UP, DOWN, RIGHT, LEFT or NO_ACTION for each world.
+        Returns boolean arrays (ate, done): whether snake ate food this tick
+        and whether its game is over. Finished worlds are left as they are
+        until reset().
+
+        """
+        actions = np.asarray(actions)
+
+        # 1. collisions from previous tick
+        head_x, head_y = self.head[:, 0], self.head[:, 1]
+        self.done |= self.bitten | self.wall[head_y, head_x]
+        alive = ~self.done
+        ate = alive & (self.head == self.food).all(axis=1)
+
+        # 2. turn, grow and move
+        direction = DIRECTIONS[np.maximum(actions, 0)]
+        turn = alive & (actions != NO_ACTION) & (direction + self.direction != 0).any(axis=1)
+        self.direction[turn] = direction[turn]
+
+        self.max_length += ate
+        idx = np.flatnonzero(alive)
+        self.tick[idx] += 1
+        self.length[idx] = np.minimum(self.length[idx] + 1, self.max_length[idx])
+        self.head[idx] += self.direction[idx]
+        x, y = self.head[idx, 0], self.head[idx, 1]
+        # the tail has moved already, so a cell entered `length` ticks ago is no longer part of the body
+        self.bitten[idx] = self.entered[idx, y, x] > self.tick[idx] - self.length[idx]
+        self.entered[idx, y, x] = self.tick[idx]
+
+        # 3. respawn eaten food
+        self.spawn_food(np.flatnonzero(ate))
+
+        return ate, self.done.copy()
+
+
+def main():
+    N_WORLDS = 1000
+    N_STEPS = 1000
+
+    world = BatchedSnakeWorld(N_WORLDS, seed=0)
+    rng = np.random.default_rng(0)
+    games, moves = 0, 0
+
+    t0 = timer()
+    for _ in range(N_STEPS):
+        actions = np.where(rng.random(N_WORLDS) < 0.1, rng.integers(0, 4, N_WORLDS), NO_ACTION)
+        ate, done = world.step(actions)
+        moves += np.count_nonzero(~done)
+        games += np.count_nonzero(done)
+        world.reset(done)
+    dt = timer() - t0
+
+    print(f"{N_WORLDS} worlds x {N_STEPS} steps in {dt:.2f} s")
+    print(f"{moves/dt:,.0f} snake moves/s, {games/dt:,.0f} finished games/s")
+
+
+if __name__ == "__main__":
+    main()
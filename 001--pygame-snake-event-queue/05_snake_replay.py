@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Recording, replay and fast-forward for the two player Snake game
+
+Copyright (c) 2021 Tomas Karabela
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import importlib
+import io
+import pickle
+import random
+import struct
+from dataclasses import dataclass, field
+from timeit import default_timer as timer
+from typing import Dict, List, Tuple
+
+import pygame
+
+snake_game = importlib.import_module("03_snake_events_multiplayer")
+World = snake_game.World
+Message = snake_game.Message
+InputSource = snake_game.InputSource
+SnakeChangeDirectionMessage = snake_game.SnakeChangeDirectionMessage
+TogglePauseMessage = snake_game.TogglePauseMessage
+QuitMessage = snake_game.QuitMessage
+
+# ----------------------------------------------------------------------
+# RECORDING FORMAT
+# ----------------------------------------------------------------------
+#
+# Game logic is deterministic given the RNG seed and player input, so that
+# is all we need to store. The file starts with a header:
+#
+#   magic b"SNAKEREC", version (u8), seed (u64), width (u16), height (u16)
+#
+# followed by one record for each tick with some input:
+#
+#   ticks since previous record (varint), number of messages (varint), messages
+#
+# where each message is one byte, 0-3 for change of direction (followed by
+# player number as varint) or 4 for toggling pause. The last record has
+# zero messages and marks the end of recording.
+
+MAGIC = b"SNAKEREC"
+VERSION = 1
+HEADER = struct.Struct("<8sBQHH")
+DIRECTIONS = [(0, -1), (0, 1), (1, 0), (-1, 0)]  # message byte -> direction
+TOGGLE_PAUSE = 4
+
+
+def write_varint(out: bytearray, value: int):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Return (value, position after the varint)"""
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+@dataclass
+class Recording:
+    seed: int
+    width: int
+    height: int
+    n_ticks: int = 0
+    inputs: Dict[int, List[Message]] = field(default_factory=dict)  # tick -> messages, only ticks with input
+
+    def to_bytes(self) -> bytes:
+        out = bytearray(HEADER.pack(MAGIC, VERSION, self.seed, self.width, self.height))
+        previous_tick = 0
+        for tick in sorted(self.inputs):
+            messages = self.inputs[tick]
+            write_varint(out, tick - previous_tick)
+            write_varint(out, len(messages))
+            for message in messages:
+                if isinstance(message, SnakeChangeDirectionMessage):
+                    out.append(DIRECTIONS.index(message.direction))
+                    write_varint(out, message.player)
+                else:
+                    out.append(TOGGLE_PAUSE)
+            previous_tick = tick
+        write_varint(out, self.n_ticks - previous_tick)
+        write_varint(out, 0)
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "Recording":
+        magic, version, seed, width, height = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a Snake recording (or unsupported version)")
+
+        recording = cls(seed=seed, width=width, height=height)
+        pos = HEADER.size
+        tick = 0
+        while True:
+            delta, pos = read_varint(data, pos)
+            n_messages, pos = read_varint(data, pos)
+            tick += delta
+            if n_messages == 0:
+                recording.n_ticks = tick
+                return recording
+
+            messages: List[Message] = []
+            for _ in range(n_messages):
+                code = data[pos]
+                pos += 1
+                if code == TOGGLE_PAUSE:
+                    messages.append(TogglePauseMessage())
+                else:
+                    player, pos = read_varint(data, pos)
+                    messages.append(SnakeChangeDirectionMessage(player=player, direction=DIRECTIONS[code]))
+            recording.inputs[tick] = messages
+
+    def save(self, path: str):
+        with open(path, "wb") as fp:
+            fp.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with open(path, "rb") as fp:
+            return cls.from_bytes(fp.read())
+
+# ----------------------------------------------------------------------
+# INPUT SOURCES
+# ----------------------------------------------------------------------
+
+class RecordingInputSource(InputSource):
+    """Passes input from another source to the world, writing it into a recording"""
+
+    def __init__(self, source: InputSource, recording: Recording):
+        self.source = source
+        self.recording = recording
+
+    def poll(self) -> List[Message]:
+        messages = self.source.poll()
+        self.recording.n_ticks += 1
+        recorded = [message for message in messages
+                    if isinstance(message, (SnakeChangeDirectionMessage, TogglePauseMessage))]
+        if recorded:
+            self.recording.inputs[self.recording.n_ticks] = recorded
+        return messages
+
+
+class ReplayInputSource(InputSource):
+    """Plays back input from a recording, quits when the recording ends"""
+
+    def __init__(self, recording: Recording):
+        self.recording = recording
+        self.tick = 0
+
+    def poll(self) -> List[Message]:
+        self.tick += 1
+        if self.tick > self.recording.n_ticks:
+            return [QuitMessage()]
+        return list(self.recording.inputs.get(self.tick, ()))
+
+
+class WindowReplayInputSource(ReplayInputSource):
+    """
+    Plays back input from a recording in the game window, which can be closed or paused with P
+
+    While the viewer holds the game paused, the recording does not advance, so that
+    the rest of it is played back on the same world state as it was recorded.
+    """
+
+    def __init__(self, recording: Recording):
+        super().__init__(recording)
+        self.held = False  # paused by the viewer
+        self.recording_paused = False  # paused in the recording itself
+
+    def poll(self) -> List[Message]:
+        toggle = False
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                return [QuitMessage()]
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_p:
+                toggle = not toggle
+
+        messages: List[Message] = []
+        if toggle:
+            self.held = not self.held
+            if not self.recording_paused:
+                messages.append(TogglePauseMessage())
+        if self.held:
+            return messages
+
+        played = super().poll()
+        if sum(isinstance(message, TogglePauseMessage) for message in played) % 2:
+            self.recording_paused = not self.recording_paused
+        return messages + played
+
+# ----------------------------------------------------------------------
+# REPLAY
+# ----------------------------------------------------------------------
+
+class Replayer:
+    """
+    Re-simulates a recorded game as fast as possible, without rendering
+
+    A copy of the world is kept every `snapshot_interval` ticks on the way,
+    so that seeking to any tick (forward or back) only needs to simulate
+    from the nearest earlier snapshot, ie. at most `snapshot_interval` ticks.
+    """
+
+    def __init__(self, recording: Recording, snapshot_interval: int = 250):
+        self.recording = recording
+        self.snapshot_interval = snapshot_interval
+        self.snapshots: Dict[int, bytes] = {}  # tick -> pickled world after that tick
+
+        self.world = World(recording.width, recording.height,
+                           input_source=ReplayInputSource(recording), seed=recording.seed)
+        snake_game.setup_world(self.world)
+        self.take_snapshot()
+
+    def take_snapshot(self):
+        # the recording never changes, so it's left out of snapshots and shared by all of them
+        buffer = io.BytesIO()
+        pickler = pickle.Pickler(buffer, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = lambda obj: "recording" if obj is self.recording else None
+        pickler.dump(self.world)
+        self.snapshots[self.world.tick] = buffer.getvalue()
+
+    def restore_snapshot(self, tick: int) -> World:
+        unpickler = pickle.Unpickler(io.BytesIO(self.snapshots[tick]))
+        unpickler.persistent_load = lambda pid: self.recording
+        return unpickler.load()
+
+    def seek(self, tick: int) -> World:
+        """Return the world as it was after given tick (clamped to the recording, or when the game ended, if earlier)"""
+        tick = max(min(tick, self.recording.n_ticks), min(self.snapshots))
+        start = max(t for t in self.snapshots if t <= tick)
+        if start > self.world.tick or tick < self.world.tick:
+            self.world = self.restore_snapshot(start)
+
+        while self.world.running and self.world.tick < tick:
+            self.world.update()
+            if self.world.tick % self.snapshot_interval == 0 and self.world.tick not in self.snapshots:
+                self.take_snapshot()
+
+        return self.world
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("record", help="play the game and record it").add_argument("path")
+    subparsers.add_parser("play", help="watch recorded game in real time").add_argument("path")
+    seek_parser = subparsers.add_parser("seek", help="fast-forward recorded game to given tick")
+    seek_parser.add_argument("path")
+    seek_parser.add_argument("tick", type=int)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        recording = Recording(seed=random.randrange(2**32), width=120, height=80)
+        snake_game.main(input_source=RecordingInputSource(snake_game.KeyboardInputSource(), recording),
+                        seed=recording.seed)
+        recording.save(args.path)
+        print(f"Recorded {recording.n_ticks} ticks into {args.path}")
+    elif args.command == "play":
+        recording = Recording.load(args.path)
+        snake_game.main(input_source=WindowReplayInputSource(recording), seed=recording.seed)
+    else:
+        recording = Recording.load(args.path)
+        t0 = timer()
+        world = Replayer(recording).seek(args.tick)
+        dt = timer() - t0
+        print(f"Reached tick {world.tick} of {recording.n_ticks} in {1e3*dt:.1f} ms")
+        for entity in world.entities:
+            if isinstance(entity, snake_game.Snake):
+                print(f"PLAYER {entity.player} SCORE: {entity.max_length}, head at {entity.body[0]}")
+
+
+if __name__ == "__main__":
+    main()
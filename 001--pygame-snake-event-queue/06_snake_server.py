@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Networked multiplayer Snake (asyncio server and client)
+
+Copyright (c) 2021 Tomas Karabela
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import asyncio
+import heapq
+import importlib
+import logging
+import random
+import socket
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+snake_game = importlib.import_module("03_snake_events_multiplayer")
+logger = logging.getLogger("snake.server")
+World = snake_game.World
+Snake = snake_game.Snake
+Food = snake_game.Food
+Wall = snake_game.Wall
+Message = snake_game.Message
+OccupancyGrid = snake_game.OccupancyGrid
+
+# ----------------------------------------------------------------------
+# PROTOCOL
+# ----------------------------------------------------------------------
+#
+# The server runs the only real copy of the world. Clients send one byte
+# whenever the player presses a key: 0-3 for up, down, right, left.
+#
+# The server sends frames made of a header (type u8, payload length u32)
+# and payload. After connecting, the client receives WELCOME (its player
+# number, board width and height) and SNAPSHOT with all non-empty cells.
+# After that, it receives one DELTA frame per tick with cells which
+# changed during the tick. SNAPSHOT and DELTA payloads are the same:
+#
+#   tick (u32), then for every cell: x (u16), y (u16), kind (u8), player (u16)
+#
+# Cell states are absolute, so applying a change twice does no harm.
+# A SNAPSHOT is also sent to everyone whenever a new round starts.
+
+WELCOME, SNAPSHOT, DELTA = 1, 2, 3
+FRAME_HEADER = struct.Struct("<BI")
+WELCOME_PAYLOAD = struct.Struct("<HHH")
+TICK = struct.Struct("<I")
+CELL = struct.Struct("<HHBH")
+EMPTY, WALL, FOOD, HEAD, BODY = range(5)
+DIRECTIONS = [(0, -1), (0, 1), (1, 0), (-1, 0)]  # input byte -> direction
+MAX_WRITE_BUFFER = 1 << 20  # clients which don't keep up with this much data are disconnected
+MAX_PLAYER = 0xffff  # player numbers are u16, 0 means no player
+
+Cell = Tuple[int, int]  # kind, player
+
+
+def encode_frame(frame_type: int, payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(frame_type, len(payload)) + payload
+
+
+def cell_state(grid: OccupancyGrid, position: Tuple[int, int]) -> Cell:
+    """Return (kind, player) describing what is seen in given cell"""
+    top = max(grid.cells.get(position, ()), key=lambda entity: entity.layer, default=None)
+    if isinstance(top, Snake):
+        return (HEAD if position == top.body[0] else BODY), top.player
+    elif isinstance(top, Food):
+        return FOOD, 0
+    elif isinstance(top, Wall):
+        return WALL, 0
+    else:
+        return EMPTY, 0
+
+
+def set_nodelay(writer: asyncio.StreamWriter):
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # don't delay small frames
+
+# ----------------------------------------------------------------------
+# SERVER
+# ----------------------------------------------------------------------
+
+class NetworkInputSource(snake_game.InputSource):
+    """Collects messages from connected players until the next tick"""
+
+    def __init__(self):
+        self.messages: List[Message] = []
+
+    def poll(self) -> List[Message]:
+        messages, self.messages = self.messages, []
+        return messages
+
+
+class SnakeServer:
+    """
+    Authoritative game server, running the tick loop of one World for many players
+
+    Every player gets a snake when they connect. When all snakes die,
+    a new round starts for everyone who is connected. Each tick, cells
+    which changed (moved heads, dropped tails, eaten and spawned food)
+    are encoded once and the same DELTA frame is sent to all players.
+    """
+
+    def __init__(self, width: int = 120, height: int = 80, tick_rate: float = 10.0, seed: Optional[int] = None):
+        self.width = width
+        self.height = height
+        self.tick_rate = tick_rate
+        self.rng = random.Random(seed)
+        self.input_source = NetworkInputSource()
+        self.writers: Dict[int, asyncio.StreamWriter] = {}  # player -> connection
+        self.snakes: Dict[int, Snake] = {}  # player -> snake in current round
+        self.next_player = 1
+        self.free_players: List[int] = []  # min-heap of numbers released by disconnected players
+        self.world = self.new_world()
+
+    def new_world(self) -> World:
+        world = World(self.width, self.height, input_source=self.input_source, seed=self.rng.randrange(2**32))
+        world.add_entity(Wall([(x, 0) for x in range(self.width)] + [(x, self.height-1) for x in range(self.width)] +
+                              [(0, y) for y in range(self.height)] + [(self.width-1, y) for y in range(self.height)]))
+        world.on_spawn_food(snake_game.SpawnFoodMessage())
+        world.grid.dirty.clear()  # new players get a snapshot, so the initial cells are not sent again in a DELTA
+        return world
+
+    def spawn_snake(self, player: int) -> Optional[Snake]:
+        """Put a new snake heading right on a free spot, return None if there is no room"""
+        for _ in range(100):
+            position = self.world.grid.random_free_cell(self.rng)
+            if position is None:
+                return None
+            x, y = position
+            body = [(x, y), (x-1, y), (x-2, y)]
+            ahead = [(x+i, y) for i in range(1, 6)]
+            if all(position in self.world.grid.free_index for position in body + ahead):
+                color = tuple(self.rng.randrange(64, 256) for _ in range(3))
+                snake = Snake(body=body, direction=(1, 0), max_length=3, player=player, color=color)
+                self.world.add_entity(snake)
+                self.snakes[player] = snake
+                return snake
+        return None
+
+    def encode_cells(self, positions: Iterable[Tuple[int, int]]) -> bytes:
+        grid = self.world.grid
+        parts = [TICK.pack(self.world.tick)]
+        for position in positions:
+            x, y = position
+            if 0 <= x < self.width and 0 <= y < self.height:
+                parts.append(CELL.pack(x, y, *cell_state(grid, position)))
+        return b"".join(parts)
+
+    def encode_snapshot(self) -> bytes:
+        return encode_frame(SNAPSHOT, self.encode_cells(list(self.world.grid.cells)))
+
+    def new_round(self) -> bytes:
+        """Start a new round for everyone who is connected, return frame to be sent to all players"""
+        self.world = self.new_world()
+        self.snakes.clear()
+        for player in self.writers:
+            self.spawn_snake(player)
+        self.world.grid.dirty.clear()
+        return self.encode_snapshot()
+
+    def update(self) -> bytes:
+        """Advance the game by one tick, return frame to be sent to all players"""
+        if not self.world.running:
+            return self.new_round()  # everyone is out of the game
+
+        self.world.update()
+        frame = encode_frame(DELTA, self.encode_cells(self.world.grid.dirty))
+        self.world.grid.dirty.clear()
+        return frame
+
+    def broadcast(self, frame: bytes):
+        for player, writer in list(self.writers.items()):
+            if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                writer.close()  # too slow, handle_client() will clean up
+            else:
+                writer.write(frame)
+
+    async def run_ticks(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            if self.writers:
+                try:
+                    frame = self.update()
+                except Exception:
+                    # eg. no room left for food; the world may be half-updated, so don't keep it
+                    logger.exception("tick %d failed, starting a new round", self.world.tick)
+                    frame = self.new_round()
+                self.broadcast(frame)
+            next_tick += 1.0 / self.tick_rate
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    def take_player(self) -> Optional[int]:
+        """Return lowest free player number, None if all are taken"""
+        if self.free_players:
+            return heapq.heappop(self.free_players)
+        if self.next_player > MAX_PLAYER:
+            return None
+        self.next_player += 1
+        return self.next_player - 1
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        set_nodelay(writer)
+        player = self.take_player()
+        if player is None:
+            logger.warning("no free player number, refusing connection")
+            writer.close()
+            return
+        self.writers[player] = writer
+        self.spawn_snake(player)
+        writer.write(encode_frame(WELCOME, WELCOME_PAYLOAD.pack(player, self.width, self.height)) +
+                     self.encode_snapshot())
+
+        try:
+            while True:
+                code = (await reader.readexactly(1))[0]
+                if code < len(DIRECTIONS):
+                    self.input_source.messages.append(
+                        snake_game.SnakeChangeDirectionMessage(player=player, direction=DIRECTIONS[code]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.writers[player]
+            snake = self.snakes.pop(player, None)
+            if snake is not None:
+                self.world.remove_entity(snake)  # does nothing if the snake is already gone
+            heapq.heappush(self.free_players, player)
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.run_ticks())
+
+# ----------------------------------------------------------------------
+# CLIENT
+# ----------------------------------------------------------------------
+
+class SnakeClient:
+    """Connection to SnakeServer, keeping a copy of the board from received frames"""
+
+    def __init__(self):
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.player = 0
+        self.width = 0
+        self.height = 0
+        self.tick = 0
+        self.board: Dict[Tuple[int, int], Cell] = {}  # non-empty cells
+        self.changed: List[Tuple[int, int]] = []  # cells changed by last frame
+
+    async def connect(self, host: str, port: int):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        set_nodelay(self.writer)
+        frame_type = await self.receive()
+        if frame_type != WELCOME:
+            raise ConnectionError("Expected WELCOME frame from the server")
+
+    async def receive(self) -> int:
+        """Read and apply one frame, return its type"""
+        frame_type, length = FRAME_HEADER.unpack(await self.reader.readexactly(FRAME_HEADER.size))
+        payload = await self.reader.readexactly(length)
+
+        if frame_type == WELCOME:
+            self.player, self.width, self.height = WELCOME_PAYLOAD.unpack(payload)
+            return frame_type
+
+        if frame_type == SNAPSHOT:
+            self.changed = list(self.board)
+            self.board.clear()
+        else:
+            self.changed = []
+        self.tick, = TICK.unpack_from(payload)
+        for x, y, kind, player in CELL.iter_unpack(payload[TICK.size:]):
+            if kind == EMPTY:
+                self.board.pop((x, y), None)
+            else:
+                self.board[(x, y)] = (kind, player)
+            self.changed.append((x, y))
+        return frame_type
+
+    def send_direction(self, direction: Tuple[int, int]):
+        self.writer.write(bytes([DIRECTIONS.index(direction)]))
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass  # closed by the server already
+
+
+async def play(host: str, port: int):
+    """Show the game in a window, send arrow keys to the server"""
+    import pygame
+
+    SCALE = 8
+    KEY_DIRECTIONS = {pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1), pygame.K_RIGHT: (1, 0), pygame.K_LEFT: (-1, 0)}
+    COLORS = {EMPTY: (255, 255, 255), WALL: (100, 100, 100), FOOD: (255, 0, 0)}
+
+    client = SnakeClient()
+    await client.connect(host, port)
+
+    pygame.init()
+    pygame.display.set_caption(f"Snake game (player {client.player})")
+    display = pygame.display.set_mode((SCALE*client.width, SCALE*client.height))
+    display.fill(COLORS[EMPTY])
+    receiving = asyncio.ensure_future(client.receive())
+
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.KEYDOWN and event.key in KEY_DIRECTIONS:
+                client.send_direction(KEY_DIRECTIONS[event.key])
+
+        # draw cells changed by received frames
+        rects = []
+        while receiving.done():
+            try:
+                receiving.result()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                print("Server closed the connection")
+                running = False
+                break
+            for x, y in client.changed:
+                kind, player = client.board.get((x, y), (EMPTY, 0))
+                if kind in COLORS:
+                    color = COLORS[kind]
+                else:
+                    color = (0, 200, 0) if player == client.player else (112, 214, 255)
+                    if kind == HEAD:
+                        color = tuple(int(0.8*c) for c in color)
+                rects.append(display.fill(color, (x*SCALE, y*SCALE, SCALE, SCALE)))
+            receiving = asyncio.ensure_future(client.receive())
+        pygame.display.update(rects)
+
+        await asyncio.sleep(1/60)
+
+    receiving.cancel()
+    await client.close()
+    pygame.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("mode", choices=["server", "client"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--tick-rate", type=float, default=10.0, help="ticks per second (server only)")
+    parser.add_argument("--log-level", default="WARNING", help="eg. INFO for game events")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s %(message)s")
+
+    if args.mode == "server":
+        asyncio.run(SnakeServer(tick_rate=args.tick_rate).serve(args.host, args.port))
+    else:
+        asyncio.run(play(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
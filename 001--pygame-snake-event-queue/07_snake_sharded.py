@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+"""
+Sharded Snake arena (large board split between worker processes)
+
+Copyright (c) 2021 Tomas Karabela
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import multiprocessing as mp
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory  # Python 3.8+
+from timeit import default_timer as timer
+from typing import Callable, Dict, List, Optional, Tuple
+
+# actions, in the same order as in 04_snake_vectorized.py
+UP, DOWN, RIGHT, LEFT = range(4)
+NO_ACTION = -1
+DIRECTIONS = np.asarray([(0, -1), (0, 1), (1, 0), (-1, 0)], dtype=np.int64)  # action -> (dx, dy)
+
+# indices into ArenaState.control
+TICK, STOP = range(2)
+
+REGION_ROWS = 16  # food is respawned within the band of rows where it was eaten, each band has its own RNG
+MAX_ATTEMPTS = 1000  # random cells to try when looking for a free one
+
+# ----------------------------------------------------------------------
+# SHARED STATE
+# ----------------------------------------------------------------------
+
+def array_specs(width: int, height: int, n_snakes: int, ticks_per_round: int,
+                n_shards: int) -> Dict[str, Tuple[Tuple[int, ...], str]]:
+    """Return name -> (shape, dtype) of arrays describing the arena"""
+    return {
+        "owner": ((height, width), "int32"),  # 1 + index of the snake whose head entered the cell last, 0 if none
+        "entered": ((height, width), "int32"),  # tick when that happened
+        "food": ((height, width), "bool"),
+        "head": ((n_snakes, 2), "int64"),  # (x, y)
+        "direction": ((n_snakes, 2), "int64"),  # (dx, dy)
+        "length": ((n_snakes,), "int32"),  # at the start of the round
+        "max_length": ((n_snakes,), "int32"),
+        "alive": ((n_snakes,), "bool"),
+        "dying": ((n_snakes,), "bool"),  # crashed during last round
+        "ate": ((n_snakes,), "int32"),  # food eaten during last round
+        "actions": ((ticks_per_round, n_snakes), "int8"),
+        "members": ((n_shards, n_snakes), "int32"),  # snakes with the head in each strip, sorted by y of the head
+        "member_y": ((n_shards, n_snakes), "int64"),  # y of their heads
+        "n_members": ((n_shards,), "int64"),
+        "control": ((2,), "int64"),  # TICK, STOP
+    }
+
+
+class ArenaState:
+    """
+    Arrays describing the arena, in private memory or in shared memory blocks
+
+    Pass `shared=True` to create shared blocks, or `block_names` of another
+    ArenaState.blocks to attach to existing ones (in a worker process).
+    """
+
+    def __init__(self, width: int, height: int, n_snakes: int, ticks_per_round: int, n_shards: int,
+                 shared: bool = False, block_names: Optional[List[str]] = None):
+        self.width = width
+        self.height = height
+        self.specs = array_specs(width, height, n_snakes, ticks_per_round, n_shards)
+        self.owns_blocks = block_names is None
+        self.blocks: List[SharedMemory] = []
+
+        for i, (name, (shape, dtype)) in enumerate(self.specs.items()):
+            if block_names is not None:
+                block = SharedMemory(name=block_names[i])
+            elif shared:
+                nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                block = SharedMemory(create=True, size=max(nbytes, 1))  # new blocks are filled with zeros
+            else:
+                setattr(self, name, np.zeros(shape, dtype=dtype))
+                continue
+            self.blocks.append(block)
+            setattr(self, name, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+    def covers(self, owner: np.ndarray, entered: np.ndarray, tick: int) -> np.ndarray:
+        """Return whether cells with given owner and tick of entering are covered by a snake at `tick`"""
+        owner = owner.astype(np.int64) - 1
+        # a cell belongs to the body iff the head entered it during the last `length` ticks (see 04_snake_vectorized.py);
+        # during a round, snakes grow by one cell per tick up to the max_length they had at its start
+        length = np.minimum(self.length[owner] + (tick - self.control[TICK]), self.max_length[owner])
+        return (owner >= 0) & self.alive[owner] & (entered > tick - length)
+
+    def is_body(self, x: np.ndarray, y: np.ndarray, tick: int) -> np.ndarray:
+        """Return whether given cells are covered by a snake, as of the start of the round"""
+        return self.covers(self.owner[y, x], self.entered[y, x], tick)
+
+    def close(self):
+        for name in self.specs:
+            delattr(self, name)  # arrays must go before their buffers are closed
+        for block in self.blocks:
+            block.close()
+            if self.owns_blocks:
+                block.unlink()
+        self.blocks.clear()
+
+
+def random_free_cell(rng: np.random.Generator, x0: int, x1: int, y0: int, y1: int,
+                     is_free: Callable[[int, int], bool]) -> Optional[Tuple[int, int]]:
+    """Return random (x, y) with x0 <= x < x1, y0 <= y < y1 for which `is_free` holds, None if none was found"""
+    if x0 >= x1 or y0 >= y1:
+        return None
+    for _ in range(MAX_ATTEMPTS):
+        x, y = int(rng.integers(x0, x1)), int(rng.integers(y0, y1))
+        if is_free(x, y):
+            return x, y
+    return None
+
+# ----------------------------------------------------------------------
+# SHARDS
+# ----------------------------------------------------------------------
+#
+# The board is split into horizontal strips, one per shard. The arena
+# advances in rounds of `ticks_per_round` ticks, each round has two phases
+# with a barrier before, between and after them:
+#
+# 1. simulate: a shard reads the shared arrays as they were at the start
+#    of the round and plays all its ticks in private memory, for its own
+#    snakes and the snakes of neighbouring shards whose head is at most
+#    `ticks_per_round` rows from its strip (the halo). A cell only depends
+#    on its neighbours in the previous tick, so whatever happens outside
+#    the halo cannot get to the strip until the round is over, and the
+#    strip ends up the same as if the whole board was played at once.
+#
+# 2. write back: a shard writes the cells of its strip and the snakes
+#    whose head is in its strip at the end of the round, which includes
+#    snakes handed off by the neighbours - the neighbours played them too,
+#    but do not write them. Each shard then lists its snakes for the next
+#    round, sorted by y, so that neighbours can find those near the border.
+#
+# All shared state used in a round comes from its start, which is why snakes
+# that ate only grow and crashed snakes only disappear from the next round on.
+
+class Shard:
+    """
+    Strip of rows y0 <= y < y1 of the arena and snakes with the head in it
+
+    The shard owns the food RNGs of regions in its strip, so that food
+    eaten in the strip is respawned the same way for any number of shards.
+    """
+
+    def __init__(self, state: ArenaState, index: int, strips: List[Tuple[int, int]],
+                 regions: List[Tuple[int, int, np.random.SeedSequence]]):
+        self.state = state
+        self.index = index
+        self.strips = strips
+        self.y0, self.y1 = strips[index]
+        self.regions = [(r0, r1, np.random.default_rng(seed)) for r0, r1, seed in regions if self.y0 <= r0 < self.y1]
+        self.region_starts = np.asarray([r0 for r0, _, _ in self.regions])
+        self.ticks = state.actions.shape[0]
+
+    def snakes(self, shard: int, y0: int, y1: int) -> np.ndarray:
+        """Return snakes of given shard with the head in rows y0 <= y < y1"""
+        n = self.state.n_members[shard]
+        lo, hi = np.searchsorted(self.state.member_y[shard, :n], [y0, y1])
+        return self.state.members[shard, lo:hi]
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (hit, position) of given cells in cells entered during this round"""
+        pos = np.searchsorted(self.cells, keys)
+        hit = pos < len(self.cells)
+        hit[hit] = self.cells[pos[hit]] == keys[hit]
+        return hit, pos
+
+    def is_body(self, x: np.ndarray, y: np.ndarray, tick: int) -> np.ndarray:
+        """Return whether given cells are covered by a snake at `tick` of this round"""
+        state = self.state
+        owner, entered = state.owner[y, x].astype(np.int64), state.entered[y, x].astype(np.int64)
+        hit, pos = self.lookup(y * state.width + x)
+        owner[hit] = self.cell_owner[pos[hit]]
+        entered[hit] = self.cell_tick[pos[hit]]
+        return state.covers(owner, entered, tick)
+
+    def is_free(self, x: int, y: int) -> bool:
+        key = y * self.state.width + x
+        has_food = self.state.food[y, x] and key not in self.eaten
+        return (not has_food and (x, y) not in self.new_food
+                and not self.is_body(np.asarray([x]), np.asarray([y]), self.tick)[0])
+
+    def simulate(self):
+        """Play this round in private memory"""
+        state = self.state
+        width, h = state.width, self.ticks
+        self.tick = int(state.control[TICK])
+        self.cells = np.zeros(0, dtype=np.int64)  # cells entered during the round, sorted
+        self.cell_owner = np.zeros(0, dtype=np.int64)
+        self.cell_tick = np.zeros(0, dtype=np.int64)
+        self.eaten = np.zeros(0, dtype=np.int64)  # cells where food was eaten
+        self.new_food: List[Tuple[int, int]] = []
+
+        idx = [self.snakes(self.index, self.y0, self.y1)]
+        if self.index > 0:
+            idx.append(self.snakes(self.index - 1, self.y0 - h, self.y0))
+        if self.index + 1 < len(self.strips):
+            idx.append(self.snakes(self.index + 1, self.y1, self.y1 + h))
+        self.idx = idx = np.concatenate(idx).astype(np.int64)
+        self.head = head = state.head[idx]
+        self.direction = direction = state.direction[idx]
+        self.moving = moving = np.ones(len(idx), dtype=bool)
+        self.ate = ate = np.zeros(len(idx), dtype=np.int32)
+
+        for j in range(h):
+            self.tick += 1
+            live = np.flatnonzero(moving)
+            actions = state.actions[j, idx[live]].astype(np.int64)
+            turned = DIRECTIONS[np.maximum(actions, 0)]
+            turn = (actions != NO_ACTION) & (turned + direction[live] != 0).any(axis=1)  # turning back is ignored
+            direction[live[turn]] = turned[turn]
+
+            x, y = (head[live] + direction[live]).T
+            wall = (x == 0) | (y == 0) | (x == width - 1) | (y == state.height - 1)
+            # the tail has moved already, so it's not in the way
+            body = self.is_body(x, y, self.tick)
+            keys = y * width + x
+            _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+            head_on = counts[inverse] > 1
+            crashed = wall | body | head_on
+            moving[live[crashed]] = False
+
+            ok = ~crashed
+            live, x, y, keys = live[ok], x[ok], y[ok], keys[ok]
+            head[live, 0], head[live, 1] = x, y
+            # newly entered cells replace older entries of the same cell
+            self.cells, first = np.unique(np.concatenate([keys, self.cells]), return_index=True)
+            self.cell_owner = np.concatenate([idx[live] + 1, self.cell_owner])[first]
+            self.cell_tick = np.concatenate([np.full(len(live), self.tick), self.cell_tick])[first]
+
+            food = state.food[y, x] & ~np.isin(keys, self.eaten)
+            ate[live[food]] += 1
+            self.eaten = np.concatenate([self.eaten, keys[food]])
+
+        # respawn food eaten in the strip, region by region
+        eaten_y = self.eaten // width
+        in_strip = (eaten_y >= self.y0) & (eaten_y < self.y1)
+        regions, counts = np.unique(np.searchsorted(self.region_starts, eaten_y[in_strip], side="right") - 1,
+                                    return_counts=True)
+        for region, count in zip(regions.tolist(), counts.tolist()):
+            r0, r1, rng = self.regions[region]
+            for _ in range(count):
+                cell = random_free_cell(rng, 1, width - 1, max(r0, 1), min(r1, state.height - 1), self.is_free)
+                if cell is not None:  # the region is full, the food is gone
+                    self.new_food.append(cell)
+
+    def write_back(self):
+        """Write the strip and its snakes to the shared arrays"""
+        state = self.state
+        y, x = np.divmod(self.cells, state.width)
+        mine = (y >= self.y0) & (y < self.y1)
+        state.owner[y[mine], x[mine]] = self.cell_owner[mine]
+        state.entered[y[mine], x[mine]] = self.cell_tick[mine]
+
+        y, x = np.divmod(self.eaten, state.width)
+        mine = (y >= self.y0) & (y < self.y1)
+        state.food[y[mine], x[mine]] = False
+        for x, y in self.new_food:
+            state.food[y, x] = True
+
+        # snakes with the head in the strip now, some of them may have come from the neighbours
+        mine = (self.head[:, 1] >= self.y0) & (self.head[:, 1] < self.y1)
+        idx = self.idx[mine]
+        state.head[idx] = self.head[mine]
+        state.direction[idx] = self.direction[mine]
+        state.length[idx] = np.minimum(state.length[idx] + self.ticks, state.max_length[idx])
+        state.max_length[idx] += self.ate[mine]
+        state.ate[idx] = self.ate[mine]
+        state.dying[idx] = ~self.moving[mine]
+        state.alive[idx] = self.moving[mine]
+
+        alive = self.moving[mine]
+        idx, y = idx[alive], self.head[mine][alive, 1]
+        order = np.lexsort((idx, y))
+        state.members[self.index, :len(idx)] = idx[order]
+        state.member_y[self.index, :len(idx)] = y[order]
+        state.n_members[self.index] = len(idx)
+
+
+def run_worker(width: int, height: int, n_snakes: int, ticks_per_round: int, block_names: List[str], index: int,
+               strips: List[Tuple[int, int]], regions: List[Tuple[int, int, np.random.SeedSequence]],
+               barrier: mp.Barrier):
+    state = ArenaState(width, height, n_snakes, ticks_per_round, len(strips), block_names=block_names)
+    shard = Shard(state, index, strips, regions)
+    while True:
+        barrier.wait()  # main process has prepared the round
+        if state.control[STOP]:
+            break
+        shard.simulate()
+        barrier.wait()  # nobody reads the shared arrays anymore
+        shard.write_back()
+        barrier.wait()
+    state.close()
+
+# ----------------------------------------------------------------------
+# ARENA
+# ----------------------------------------------------------------------
+
+class ShardedArena:
+    """
+    Many snakes on a large board, split into horizontal strips advanced by worker processes
+
+    The arena lives in shared memory arrays, using the same tick-stamp occupancy
+    grid as BatchedSnakeWorld from 04_snake_vectorized.py. Workers play
+    `ticks_per_round` ticks between barriers, each worker only does work for
+    snakes near its strip (see Shard). With `n_workers=0`, everything runs
+    in the main process as a single shard.
+
+    Snakes crash into walls, into any snake's body and into each other head-on.
+    This differs from World in 03_snake_events_multiplayer.py, where snakes
+    pass through each other. Food makes a snake longer and crashed snakes
+    are removed from the next round on. The result for a given seed, actions
+    and `ticks_per_round` is identical to that of `n_workers=0`, for any
+    number of workers.
+
+    Measured with `main()` on a machine with one CPU core, where workers
+    can only take turns (ticks/s for 0, 1, 2 and 4 workers):
+
+        2000x2000, 20000 snakes: 185, 185, 180, 171
+        2000x2000, 500 snakes:   3832, 3252, 2349, 1550
+        400x400, 200 snakes:     7249, 5857, 3810, 2120
+
+    The work of a shard grows with the snakes near its strip, so with 20000
+    snakes the workers together take about as long as a single process.
+    With hundreds of snakes, a tick is a few dozen NumPy calls no matter
+    how many snakes there are, and each shard makes all of them.
+    """
+
+    def __init__(self, width: int = 2000, height: int = 2000, n_snakes: int = 500, n_food: int = 500,
+                 n_workers: int = 4, ticks_per_round: int = 8, seed: Optional[int] = None):
+        self.width = width
+        self.height = height
+        self.n_snakes = n_snakes
+        self.ticks_per_round = ticks_per_round
+
+        region_bounds = [r * REGION_ROWS for r in range(max(height // REGION_ROWS, 1))] + [height]
+        n_shards = max(n_workers, 1)
+        if n_shards >= len(region_bounds):
+            raise ValueError(f"At most {len(region_bounds) - 1} workers can share a board {height} rows high")
+        strip_bounds = [region_bounds[i] for i in np.linspace(0, len(region_bounds) - 1, n_shards + 1).astype(int)]
+        self.strips = list(zip(strip_bounds[:-1], strip_bounds[1:]))
+        if n_shards > 1 and ticks_per_round > min(y1 - y0 for y0, y1 in self.strips):
+            raise ValueError(f"ticks_per_round must be at most {min(y1 - y0 for y0, y1 in self.strips)}, "
+                             f"the height of the smallest strip")
+
+        setup_seed, *region_seeds = np.random.SeedSequence(seed).spawn(len(region_bounds))
+        self.rng = np.random.default_rng(setup_seed)
+        regions = list(zip(region_bounds[:-1], region_bounds[1:], region_seeds))
+
+        self.state = ArenaState(width, height, n_snakes, ticks_per_round, n_shards, shared=n_workers > 0)
+        try:
+            self.state.control[TICK] = 3
+            for i in range(n_snakes):
+                self.place_snake(i)
+            for _ in range(n_food):
+                self.spawn_food()
+        except RuntimeError:
+            self.state.close()
+            raise
+        self.list_members()
+
+        self.shard = Shard(self.state, 0, self.strips, regions) if n_workers == 0 else None
+        self.workers: List[mp.Process] = []
+        self.barrier = mp.Barrier(n_workers + 1) if n_workers > 0 else None
+        block_names = [block.name for block in self.state.blocks]
+        for index in range(n_workers):
+            worker = mp.Process(target=run_worker, daemon=True,
+                                args=(width, height, n_snakes, ticks_per_round, block_names, index,
+                                      self.strips, regions, self.barrier))
+            worker.start()
+            self.workers.append(worker)
+
+    @property
+    def tick(self) -> int:
+        return int(self.state.control[TICK])
+
+    def is_free(self, x: int, y: int) -> bool:
+        return (0 < x < self.width - 1 and 0 < y < self.height - 1 and not self.state.food[y, x]
+                and not self.state.is_body(np.asarray([x]), np.asarray([y]), self.tick)[0])
+
+    def place_snake(self, i: int):
+        """Put snake `i` of length 3 on a random free spot, heading in a random direction"""
+        state = self.state
+        for _ in range(MAX_ATTEMPTS):
+            cell = random_free_cell(self.rng, 1, self.width - 1, 1, self.height - 1, self.is_free)
+            if cell is None:
+                break
+            x, y = cell
+            dx, dy = DIRECTIONS[self.rng.integers(0, 4)]
+            body = [(x - k*dx, y - k*dy) for k in range(3)]  # [head, ..., tail]
+            if all(self.is_free(bx, by) for bx, by in body[1:]):
+                break
+        else:
+            cell = None
+        if cell is None:
+            raise RuntimeError(f"No room for snake {i} on a {self.width}x{self.height} board, "
+                               f"use fewer snakes or a larger board")
+
+        for k, (bx, by) in enumerate(body):
+            state.owner[by, bx] = i + 1
+            state.entered[by, bx] = self.tick - k
+        state.head[i] = (x, y)
+        state.direction[i] = (dx, dy)
+        state.length[i] = state.max_length[i] = 3
+        state.alive[i] = True
+
+    def spawn_food(self):
+        cell = random_free_cell(self.rng, 1, self.width - 1, 1, self.height - 1, self.is_free)
+        if cell is None:
+            raise RuntimeError(f"No room for food on a {self.width}x{self.height} board, "
+                               f"use less food or a larger board")
+        x, y = cell
+        self.state.food[y, x] = True
+
+    def list_members(self):
+        """Fill ArenaState.members of each shard from scratch (only needed at the start)"""
+        state = self.state
+        for index, (y0, y1) in enumerate(self.strips):
+            idx = np.flatnonzero(state.alive & (state.head[:, 1] >= y0) & (state.head[:, 1] < y1))
+            idx = idx[np.argsort(state.head[idx, 1], kind="stable")]
+            state.members[index, :len(idx)] = idx
+            state.member_y[index, :len(idx)] = state.head[idx, 1]
+            state.n_members[index] = len(idx)
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Advance the arena by one round of `ticks_per_round` ticks
+
+        `actions` has shape (ticks_per_round, n_snakes) and holds one of
+        UP, DOWN, RIGHT, LEFT or NO_ACTION for each tick and snake.
+        Returns (ate, died) for this round: how many food each snake ate
+        and whether it crashed.
+        """
+        state = self.state
+        state.actions[:] = actions
+
+        if self.barrier is None:
+            self.shard.simulate()
+            self.shard.write_back()
+        else:
+            self.barrier.wait()  # start simulation
+            self.barrier.wait()  # start writing back
+            self.barrier.wait()  # wait till it's done
+
+        state.control[TICK] += self.ticks_per_round
+        ate, died = state.ate.copy(), state.dying.copy()
+        state.ate[:] = 0
+        state.dying[:] = False
+        return ate, died
+
+    def observe(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (body, food): copies of boolean (height, width) arrays"""
+        ys, xs = np.indices((self.height, self.width))
+        return self.state.is_body(xs, ys, self.tick), self.state.food.copy()
+
+    def close(self):
+        if self.barrier is not None:
+            self.state.control[STOP] = 1
+            self.barrier.wait()
+            for worker in self.workers:
+                worker.join()
+            self.barrier = None
+        self.state.close()
+
+    def __enter__(self) -> "ShardedArena":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size", type=int, default=2000, help="width and height of the board")
+    parser.add_argument("--snakes", type=int, default=500)
+    parser.add_argument("--ticks", type=int, default=512)
+    parser.add_argument("--ticks-per-round", type=int, default=8)
+    parser.add_argument("--workers", default="0,1,2,4", help="comma-separated worker counts to compare")
+    args = parser.parse_args()
+
+    h, n = args.ticks_per_round, args.snakes
+    n_rounds = max(args.ticks // h, 1)
+    results = []
+    for n_workers in map(int, args.workers.split(",")):
+        rng = np.random.default_rng(0)
+        try:
+            arena = ShardedArena(args.size, args.size, n_snakes=n, n_food=n, n_workers=n_workers,
+                                 ticks_per_round=h, seed=0)
+        except (RuntimeError, ValueError) as e:
+            parser.exit(1, f"{e}\n")
+        with arena:
+            t0 = timer()
+            for _ in range(n_rounds):
+                actions = np.where(rng.random((h, n)) < 0.1, rng.integers(0, 4, (h, n)), NO_ACTION)
+                arena.step(actions)
+            dt = timer() - t0
+            body, food = arena.observe()
+            results.append((body, food, arena.state.head.copy(), arena.state.alive.copy()))
+            print(f"{n_workers} workers: {n_rounds*h/dt:8.1f} ticks/s, "
+                  f"{np.count_nonzero(arena.state.alive)} snakes alive, {np.count_nonzero(body)} body cells")
+
+    identical = all(all(np.array_equal(a, b) for a, b in zip(results[0], result)) for result in results[1:])
+    print(f"Final state identical for all worker counts: {identical}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Compare frame times of rendering approaches used in 03_snake_events_multiplayer.py
+
+- per-pixel: every entity draws itself with surface.set_at(), text is rendered every frame
+- bulk: entities are written into surfarray view of the surface, texts are cached
+- incremental: only changed cells are redrawn and pushed to screen
+
+Run with SDL_VIDEODRIVER=dummy to measure without opening a window.
+"""
+
+import importlib
+import pygame
+from timeit import default_timer as timer
+from typing import List, Tuple
+
+snake_game = importlib.import_module("03_snake_events_multiplayer")
+
+WIDTH, HEIGHT = 120, 80
+SCALE = 8
+N_FRAMES = 40
+
+
+def serpentine(x0: int, x1: int, y0: int, y1: int) -> List[Tuple[int, int]]:
+    """Path filling given rectangle row by row, as [head, ..., tail]"""
+    path = []
+    for i, y in enumerate(range(y0, y1 + 1)):
+        xs = range(x0, x1 + 1) if i % 2 == 0 else range(x1, x0 - 1, -1)
+        path.extend((x, y) for x in xs)
+    return path[::-1]
+
+
+def make_world(surface: pygame.Surface) -> snake_game.World:
+    world = snake_game.World(WIDTH, HEIGHT, surface=surface, seed=0)
+    body1 = serpentine(2, 116, 2, 30)
+    body2 = serpentine(2, 58, 40, 76)
+    world.add_entity(snake_game.Snake(body=body1, direction=(0, 1), max_length=len(body1), player=1, color=(0, 255, 0)))
+    world.add_entity(snake_game.Snake(body=body2, direction=(1, 0), max_length=len(body2), player=2, color=(112, 214, 255)))
+    world.add_entity(snake_game.Wall([(x, 0) for x in range(WIDTH)] + [(x, HEIGHT-1) for x in range(WIDTH)] +
+                                     [(0, x) for x in range(HEIGHT)] + [(WIDTH-1, x) for x in range(HEIGHT)]))
+    world.message_queue.append(snake_game.SpawnFoodMessage())
+    world.update()
+    return world
+
+
+def score_texts(world: snake_game.World) -> List[str]:
+    return [f"PLAYER {entity.player} SCORE: {entity.max_length}"
+            for entity in world.entities if isinstance(entity, snake_game.Snake)]
+
+
+def benchmark(name: str, display: pygame.Surface, font: pygame.font.Font):
+    surface = pygame.Surface((WIDTH, HEIGHT))
+    world = make_world(surface)
+    texts = snake_game.TextCache(font)
+    renderer = snake_game.IncrementalRenderer(world, display, SCALE) if name == "incremental" else None
+    total = 0.0
+
+    for _ in range(N_FRAMES):
+        world.update()
+        t0 = timer()
+
+        if name == "per-pixel":
+            surface.fill("white")
+            for entity in world.entities:
+                entity.render(surface)
+            display.blit(pygame.transform.scale(surface, display.get_rect().size), (0, 0))
+            for i, text in enumerate(score_texts(world)):
+                display.blit(font.render(text, True, (0, 0, 0)), (15, 15 + 40*i))
+            pygame.display.flip()
+        elif name == "bulk":
+            surface.fill("white")
+            world.render()
+            display.blit(pygame.transform.scale(surface, display.get_rect().size), (0, 0))
+            for i, text in enumerate(score_texts(world)):
+                display.blit(texts.render(text), (15, 15 + 40*i))
+            pygame.display.flip()
+        else:
+            renderer.render([(texts.render(text), (15, 15 + 40*i)) for i, text in enumerate(score_texts(world))])
+
+        total += timer() - t0
+
+    n_cells = sum(len(entity.get_extent()) for entity in world.entities)
+    print(f"{name:12} {1e3*total/N_FRAMES:7.2f} ms/frame ({n_cells} cells)")
+
+
+def main():
+    pygame.init()
+    pygame.font.init()
+    font = pygame.font.SysFont('Ubuntu Sans', 30)
+    display = pygame.display.set_mode((SCALE*WIDTH, SCALE*HEIGHT))
+
+    for name in ["per-pixel", "bulk", "incremental"]:
+        benchmark(name, display, font)
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
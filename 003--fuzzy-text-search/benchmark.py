@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Benchmark of fuzzy search implementations: latency, throughput, memory and recall
+
+Copyright (c) 2021 Tomas Karabela
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import csv
+import json
+import random
+import tracemalloc
+import numpy as np
+import Levenshtein
+from rapidfuzz import process as rapidfuzz_process
+from rapidfuzz.distance import Levenshtein as rapidfuzz_levenshtein
+from timeit import default_timer as timer
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import fuzzy_search
+
+# Each query is a city from the corpus with a few typos; all engines rank cities by
+# 1 - levenshtein_distance/max(n, m) like interact_cities_levenshtein_vec() in the notebook.
+# Recall is the share of returned cities which really are among the `LIMIT` best (ties
+# with the LIMIT-th best count too), with exact scores from Levenshtein.distance().
+
+LIMIT = 10
+LENGTH_BINS = {"short": (1, 8), "medium": (9, 16), "long": (17, 1000)}  # length of the city before typos
+TYPO_ALPHABET = "abcdefghijklmnopqrstuvwxyz "
+SearchFunction = Callable[[str], List[Tuple[float, str]]]
+
+# ----------------------------------------------------------------------
+# BASELINES FROM THE NOTEBOOK
+# ----------------------------------------------------------------------
+
+def levenshtein_distance(a: str, b: str) -> int:
+    m, n = len(a), len(b)
+    d = np.zeros((m+1, n+1), dtype=int)  # d[i,j] = levenshtein_distance(a[:i], b[:j])
+
+    # when the other string is empty, distance is length of non-empty string
+    for i in range(m+1): d[i, 0] = i
+    for i in range(n+1): d[0, i] = i
+
+    for j in range(1, n+1):
+        for i in range(1, m+1):
+            cost = 1 if a[i-1] != b[j-1] else 0
+            d[i, j] = min(d[i-1, j-1] + cost,   # substitute         ↘
+                          d[i, j-1]   + 1,      # delete from B      →
+                          d[i-1, j]   + 1)      # insert into B      ↓
+
+    return d[m, n]
+
+
+def levenshtein_distance_vec(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    m, n, k = len(a), len(b), b.shape[1]
+    d = np.zeros((m+1, n+1, k), dtype=np.uint16)  # d[i,j] = levenshtein_distance(a[:i], b[:j])
+
+    # when the other string is empty, distance is length of non-empty string
+    for i in range(m+1): d[i, 0] = i
+    for i in range(n+1): d[0, i] = i
+
+    for j in range(1, n+1):
+        for i in range(1, m+1):
+            cost = a[i-1] != b[j-1]
+            d[i, j] = np.min([d[i-1, j-1] + cost,        # substitute         ↘
+                              d[i, j-1]   + 1,           # delete from B      →
+                              d[i-1, j]   + 1], axis=0)  # insert into B      ↓
+
+    return d[m, n]
+
+# ----------------------------------------------------------------------
+# ENGINES
+# ----------------------------------------------------------------------
+#
+# prepare_*() functions take the corpus and return a search function, so that
+# building indices is measured separately from queries.
+
+def score(distance: int, n: int, m: int) -> float:
+    return 1.0 - distance / max(n, m, 1)
+
+
+def prepare_python(corpus: List[str]) -> SearchFunction:
+    def search(text: str) -> List[Tuple[float, str]]:
+        return sorted(((score(levenshtein_distance(text, s), len(text), len(s)), s) for s in corpus), reverse=True)[:LIMIT]
+    return search
+
+
+def prepare_levenshtein(corpus: List[str]) -> SearchFunction:
+    def search(text: str) -> List[Tuple[float, str]]:
+        return sorted(((score(Levenshtein.distance(text, s), len(text), len(s)), s) for s in corpus), reverse=True)[:LIMIT]
+    return search
+
+
+def prepare_rapidfuzz(corpus: List[str]) -> SearchFunction:
+    def search(text: str) -> List[Tuple[float, str]]:
+        return [(s, city) for city, s, _ in rapidfuzz_process.extract(
+            text, corpus, scorer=rapidfuzz_levenshtein.normalized_similarity, limit=LIMIT)]
+    return search
+
+
+def prepare_numpy(corpus: List[str]) -> SearchFunction:
+    index = fuzzy_search.FuzzyIndex.build(corpus)
+
+    def search(text: str) -> List[Tuple[float, str]]:
+        a = np.asarray([ord(c) for c in text])
+        top = fuzzy_search.TopK(index.len_to_cities, LIMIT)
+        for m, b in index.len_to_mat.items():
+            top.add(m, 1.0 - levenshtein_distance_vec(a, b) / max(len(text), m, 1))
+        return top.results()
+    return search
+
+
+def prepare_myers(corpus: List[str]) -> SearchFunction:
+    index = fuzzy_search.FuzzyIndex.build(corpus)
+
+    def search(text: str) -> List[Tuple[float, str]]:
+        a = np.asarray([ord(c) for c in text])
+        top = fuzzy_search.TopK(index.len_to_cities, LIMIT)
+        for m, b in index.len_to_mat.items():
+            top.add(m, 1.0 - fuzzy_search.levenshtein_distance_myers(a, b) / max(len(text), m, 1))
+        return top.results()
+    return search
+
+
+def prepare_banded(corpus: List[str]) -> SearchFunction:
+    index = fuzzy_search.FuzzyIndex.build(corpus)
+    return lambda text: fuzzy_search.search_levenshtein_banded(text, index.len_to_cities, index.len_to_mat, LIMIT)
+
+
+def prepare_qgram(corpus: List[str]) -> SearchFunction:
+    qgram_index = fuzzy_search.QGramIndex(fuzzy_search.FuzzyIndex.build(corpus))
+    return lambda text: qgram_index.search(text, LIMIT)
+
+
+# name -> (prepare function, largest corpus it's run with)
+# the notebook's implementations take 0.1-0.4 s per query already for 1000 cities
+ENGINES: Dict[str, Tuple[Callable[[List[str]], SearchFunction], int]] = {
+    "python": (prepare_python, 1000),
+    "numpy": (prepare_numpy, 1000),
+    "levenshtein": (prepare_levenshtein, 10**9),
+    "rapidfuzz": (prepare_rapidfuzz, 10**9),
+    "myers": (prepare_myers, 10**9),
+    "banded": (prepare_banded, 10**9),
+    "qgram": (prepare_qgram, 10**9),
+}
+
+# ----------------------------------------------------------------------
+# QUERIES
+# ----------------------------------------------------------------------
+
+def add_typos(text: str, rng: random.Random, n_typos: int) -> str:
+    chars = list(text)
+    for _ in range(n_typos):
+        i = rng.randrange(len(chars))
+        operation = rng.choice(["insert", "delete", "replace", "swap"])
+        if operation == "insert":
+            chars.insert(i, rng.choice(TYPO_ALPHABET))
+        elif operation == "delete" and len(chars) > 1:
+            del chars[i]
+        elif operation == "swap" and i + 1 < len(chars):
+            chars[i], chars[i+1] = chars[i+1], chars[i]
+        else:
+            chars[i] = rng.choice(TYPO_ALPHABET)
+    return "".join(chars)
+
+
+def make_queries(corpus: Sequence[str], n_queries: int, seed: int) -> Dict[str, List[str]]:
+    """Return `n_queries` queries for each length bin: cities with 1-3 typos, same for the same seed"""
+    rng = random.Random(seed)
+    queries = {}
+    for name, (lo, hi) in LENGTH_BINS.items():
+        sources = [s for s in corpus if lo <= len(s) <= hi]
+        queries[name] = [add_typos(rng.choice(sources), rng, rng.randint(1, 3)) for _ in range(n_queries)] if sources else []
+    return queries
+
+# ----------------------------------------------------------------------
+# MEASUREMENT
+# ----------------------------------------------------------------------
+
+def recall(results: List[Tuple[float, str]], exact_scores: Dict[str, float], kth_best: float) -> float:
+    correct = sum(1 for _, city in results if exact_scores[city] >= kth_best - 1e-9)
+    return correct / min(LIMIT, len(exact_scores))
+
+
+def exact_top(text: str, corpus: List[str]) -> Tuple[Dict[str, float], float]:
+    """Return exact score of each city and the LIMIT-th best score"""
+    exact_scores = {s: score(Levenshtein.distance(text, s), len(text), len(s)) for s in corpus}
+    ranked = sorted(exact_scores.values(), reverse=True)
+    return exact_scores, ranked[min(LIMIT, len(ranked)) - 1]
+
+
+def peak_memory(f: Callable[[], Any]) -> Tuple[Any, float]:
+    """Return result of f() and peak memory allocated by it in KiB (Python objects and NumPy arrays)"""
+    tracemalloc.start()
+    try:
+        result = f()
+        return result, tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(engine: str, corpus: List[str], queries: Dict[str, List[str]],
+              exact: Dict[str, Tuple[Dict[str, float], float]], memory_queries: int) -> List[Dict[str, Any]]:
+    prepare, _ = ENGINES[engine]
+    t0 = timer()
+    search = prepare(corpus)
+    build_time = timer() - t0
+    _, build_peak = peak_memory(lambda: prepare(corpus))
+
+    records = []
+    for length, texts in queries.items():
+        if not texts:
+            continue
+        latencies, recalls = [], []
+        for text in texts:
+            t0 = timer()
+            results = search(text)
+            latencies.append(timer() - t0)
+            recalls.append(recall(results, *exact[text]))
+        _, query_peak = peak_memory(lambda: [search(text) for text in texts[:memory_queries]])
+
+        latencies_ms = 1e3 * np.asarray(latencies)
+        records.append({
+            "engine": engine,
+            "corpus_size": len(corpus),
+            "query_length": length,
+            "queries": len(texts),
+            "p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p95_ms": float(np.percentile(latencies_ms, 95)),
+            "p99_ms": float(np.percentile(latencies_ms, 99)),
+            "throughput_qps": len(texts) / sum(latencies),
+            "recall": float(np.mean(recalls)),
+            "build_ms": 1e3 * build_time,
+            "build_peak_kib": build_peak,
+            "query_peak_kib": query_peak,
+        })
+    return records
+
+
+def save(records: List[Dict[str, Any]], path: str):
+    """Save results as JSON or CSV, depending on the extension"""
+    with open(path, "w", newline="") as fp:
+        if path.endswith(".json"):
+            json.dump(records, fp, indent=1)
+        else:
+            writer = csv.DictWriter(fp, fieldnames=list(records[0]))
+            writer.writeheader()
+            writer.writerows(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("csv_path", nargs="?", default="Index_of_Place_Names_in_Great_Britain_(July_2016).csv")
+    parser.add_argument("--column", default="place15nm")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="corpus sizes (random samples of the cities, all of them if larger)")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument("--queries", type=int, default=50, help="number of queries for each query length")
+    parser.add_argument("--memory-queries", type=int, default=5, help="number of queries to measure peak memory on")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json", help="results file, .json or .csv")
+    args = parser.parse_args()
+
+    cities = fuzzy_search.read_cities(args.csv_path, args.column)
+    records = []
+    for size in sorted(set(min(size, len(cities)) for size in args.sizes)):
+        corpus = random.Random(args.seed).sample(cities, size)
+        queries = make_queries(corpus, args.queries, args.seed)
+        exact = {text: exact_top(text, corpus) for texts in queries.values() for text in texts}
+
+        for engine in args.engines:
+            if size > ENGINES[engine][1]:
+                continue
+            for record in benchmark(engine, corpus, queries, exact, args.memory_queries):
+                records.append(record)
+                print(f"{engine:12} {size:7} {record['query_length']:7}"
+                      f"  p50 {record['p50_ms']:8.2f} ms  p95 {record['p95_ms']:8.2f} ms  p99 {record['p99_ms']:8.2f} ms"
+                      f"  {record['throughput_qps']:8.1f} q/s  recall {record['recall']:.3f}"
+                      f"  memory {record['query_peak_kib']:8.0f} KiB")
+
+    save(records, args.output)
+    print(f"\nSaved {len(records)} results into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1429 @@
+"""
+Fuzzy search building blocks from the notebook, optimized further
+
+Copyright (c) 2021 Tomas Karabela
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import argparse
+import csv
+import heapq
+import itertools
+import math
+import os
+import re
+import struct
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+from timeit import default_timer as timer
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+# Like in the notebook, strings are NumPy arrays of code points (`a`), and strings
+# of the same length n are stacked as columns of a (n, k) matrix (`b`), see `len_to_mat`.
+
+# ----------------------------------------------------------------------
+# DISTANCE FUNCTIONS
+# ----------------------------------------------------------------------
+
+WORD_SIZE = 64
+ONE = np.uint64(1)
+ZERO = np.uint64(0)
+
+
+def levenshtein_distance_myers(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Levenshtein distance of `a` to each column of `b`, bit-parallel (Myers, Hyyrö)
+
+    Gives the same results as levenshtein_distance_vec(). Instead of numbers, a column
+    of the DP table is stored as two bit-vectors, saying where the value goes up
+    or down by one compared to the cell above. A whole column is then updated with
+    about 15 word operations, done for all k strings at once. Queries longer than 64
+    characters take ceil(m/64) words per column, linked by the horizontal difference
+    at the bottom of each block, so the running time is O(ceil(m/64) * n) operations.
+    """
+    return levenshtein_distance_cdist(np.asarray(a).reshape(-1, 1), b)[0]
+
+
+def match_bits(a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, int, np.ndarray]:
+    """
+    Return bit-vectors `peq` for strings in columns of `a` (m, g), for use with characters of `b`
+
+    Characters are renumbered to those which occur in `a`, to keep `peq` small; the rest
+    (and code 0, which is used for padding) become 0, matching nothing. Returns `peq`,
+    the number of characters `n_chars` and renumbered `b`, so that bit i of
+    peq[block, s * n_chars + b_chars[j, t]] is set iff a[64*block + i, s] == b[j, t].
+    """
+    m, g = a.shape
+    alphabet = np.unique(a)
+    alphabet = alphabet[alphabet != 0]
+    renumber = np.zeros(max(int(np.max(a)), int(np.max(b))) + 1, dtype=np.intp)
+    renumber[alphabet] = np.arange(1, len(alphabet) + 1)
+    a_chars, b_chars = renumber[a], renumber[b]
+
+    n_chars = len(alphabet) + 1
+    peq = np.zeros(((m + WORD_SIZE - 1) // WORD_SIZE, g * n_chars), dtype=np.uint64)
+    for i in range(m):
+        peq[i // WORD_SIZE, np.arange(g) * n_chars + a_chars[i]] |= ONE << np.uint64(i % WORD_SIZE)
+    peq[:, ::n_chars] = ZERO
+    return peq, n_chars, b_chars
+
+
+def levenshtein_distance_cdist(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Levenshtein distance of each column of `a` (m, g) to each column of `b` (n, k), as (g, k) matrix
+
+    Same algorithm as levenshtein_distance_myers(), with bit-vectors for all g*k pairs
+    updated at once (see match_bits()).
+    """
+    (m, g), (n, k) = a.shape, b.shape
+    if m == 0 or n == 0:
+        return np.full((g, k), m + n, dtype=np.uint16)
+    n_blocks = (m + WORD_SIZE - 1) // WORD_SIZE
+    peq, n_chars, b_chars = match_bits(a, b)
+    pair_offset = np.repeat(np.arange(g) * n_chars, k)  # pair s*k + j is a[:, s] and b[:, j]
+
+    pv = np.full((n_blocks, g * k), ~ZERO)  # +1 vertical differences, first column is 0, 1, 2, ..., m
+    mv = np.zeros((n_blocks, g * k), dtype=np.uint64)  # -1 vertical differences
+    score = np.full(g * k, m, dtype=np.int64)  # d[m, j]
+    last_bits = [np.uint64(WORD_SIZE - 1)] * (n_blocks - 1) + [np.uint64((m - 1) % WORD_SIZE)]
+
+    for j in range(n):
+        chars = pair_offset + np.tile(b_chars[j], g) if g > 1 else b_chars[j]
+        h_plus, h_minus = ONE, ZERO  # horizontal difference above the block; first row is 0, 1, 2, ..., n
+        for block in range(n_blocks):
+            eq = peq[block, chars]
+            p, mm = pv[block], mv[block]
+
+            xv = eq | mm
+            eq |= h_minus
+            xh = (((eq & p) + p) ^ p) | eq
+            ph = mm | ~(xh | p)
+            mh = p & xh
+
+            # horizontal difference below the block
+            bit = last_bits[block]
+            h_plus_out, h_minus_out = (ph >> bit) & ONE, (mh >> bit) & ONE
+
+            ph = (ph << ONE) | h_plus
+            mh = (mh << ONE) | h_minus
+            pv[block] = mh | ~(xv | ph)
+            mv[block] = ph & xv
+            h_plus, h_minus = h_plus_out, h_minus_out
+
+        score += h_plus.astype(np.int64) - h_minus.astype(np.int64)
+
+    return score.reshape(g, k).astype(np.uint16)
+
+
+def levenshtein_distance_two_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Levenshtein distance of `a` to each column of `b`, keeping only two rows of the DP table
+
+    Gives the same results as levenshtein_distance_vec(), which fills the whole
+    (m+1, n+1, k) table only to return its last cell. Here, row i of the table is
+    computed from row i-1 in preallocated buffers, with ufuncs writing into them
+    (`out=`), so that memory is O(n*k) instead of O(m*n*k) and no temporary arrays
+    are created for each cell.
+    """
+    m, (n, k) = len(a), b.shape
+    previous = np.empty((n+1, k), dtype=np.uint16)  # previous[j] = levenshtein_distance(a[:i-1], b[:j])
+    current = np.empty((n+1, k), dtype=np.uint16)  # current[j] = levenshtein_distance(a[:i], b[:j])
+    cost = np.empty((n, k), dtype=bool)
+    substitute = np.empty(k, dtype=np.uint16)
+    previous[:] = np.arange(n+1, dtype=np.uint16)[:, np.newaxis]
+
+    for i in range(1, m+1):
+        np.not_equal(b, a[i-1], out=cost)
+        current[0] = i
+        for j in range(1, n+1):
+            np.add(previous[j-1], cost[j-1], out=substitute)        # substitute         ↘
+            np.minimum(current[j-1], previous[j], out=current[j])   # delete from B      →
+            current[j] += 1                                         # or insert into B   ↓
+            np.minimum(current[j], substitute, out=current[j])
+        previous, current = current, previous
+
+    return previous[n].copy()
+
+
+def levenshtein_distance_banded(a: np.ndarray, b: np.ndarray, max_distance: int) -> np.ndarray:
+    """
+    Levenshtein distance of `a` to each column of `b`, or max_distance+1 if it's larger
+
+    Only the diagonal band |i - j| <= max_distance of the DP table is computed (Ukkonen),
+    since a path through any other cell costs more than max_distance. Cells next
+    to the band count as max_distance+1. The smallest value in a row never
+    decreases in later rows, so strings whose whole band row is over max_distance
+    are dropped from the batch early and not computed any further.
+    """
+    m, (n, k) = len(a), b.shape
+    too_far = min(max_distance + 1, np.iinfo(np.uint16).max)
+    result = np.full(k, too_far, dtype=np.uint16)
+    if abs(m - n) > max_distance:
+        return result
+
+    active = np.arange(k)  # columns of `b` still in the batch
+    previous = np.full((n+1, k), too_far, dtype=np.uint16)
+    current = np.full((n+1, k), too_far, dtype=np.uint16)
+    substitute = np.empty(k, dtype=np.uint16)
+    first = np.arange(min(n, max_distance) + 1, dtype=np.uint16)
+    previous[:len(first)] = first[:, np.newaxis]
+
+    for i in range(1, m+1):
+        lo, hi = max(1, i - max_distance), min(n, i + max_distance)
+        current[lo-1] = i if lo == 1 else too_far
+        if i + max_distance <= n:
+            previous[i + max_distance] = too_far  # just outside of the band of the previous row
+        cost = b[lo-1:hi] != a[i-1]
+        for j in range(lo, hi+1):
+            np.add(previous[j-1], cost[j-lo], out=substitute)
+            np.minimum(current[j-1], previous[j], out=current[j])
+            current[j] += 1
+            np.minimum(current[j], substitute, out=current[j])
+        previous, current = current, previous
+
+        keep = previous[lo-1:hi+1].min(axis=0) <= max_distance
+        if not keep.any():
+            return result
+        if np.count_nonzero(keep) < 0.75 * len(active):
+            active, b = active[keep], b[:, keep]
+            previous, current = previous[:, keep], current[:, keep]
+            substitute = substitute[keep]
+
+    result[active] = np.minimum(previous[n], too_far)
+    return result
+
+# ----------------------------------------------------------------------
+# SEARCH
+# ----------------------------------------------------------------------
+
+def bucket_offsets(len_to_cities: Dict[int, Sequence[str]]) -> Dict[int, int]:
+    """
+    Return global id of the first string of each bucket
+
+    Strings are numbered bucket after bucket in order of length, so that string `i` of
+    bucket `n` has id `offsets[n] + i` and ids of each bucket are contiguous.
+    """
+    offsets = {}
+    total = 0
+    for n in sorted(len_to_cities):
+        offsets[n] = total
+        total += len(len_to_cities[n])
+    return offsets
+
+
+class TopK:
+    """
+    Collects `limit` best (score, city) results, bucket by bucket
+
+    Only the `limit` best scores of each bucket (found with np.argpartition, plus ties)
+    can make it into the results, so just these become Python tuples and go through
+    a small heap, instead of sorting tuples for every string.
+    """
+
+    def __init__(self, len_to_cities: Dict[int, Sequence[str]], limit: int = 10):
+        self.len_to_cities = len_to_cities
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
+        self.best: List[Tuple[float, str]] = []  # min-heap of `limit` best results so far
+
+    @property
+    def cutoff(self) -> Optional[float]:
+        """Worst score in the results if there are `limit` of them (results with the same score may still get in)"""
+        return self.best[0][0] if len(self.best) == self.limit else None
+
+    def add(self, n: int, scores: np.ndarray, columns: Optional[np.ndarray] = None):
+        """Add scores of strings of length n, either the whole bucket or given columns of it"""
+        if len(scores) > self.limit:
+            idx = np.argpartition(scores, -self.limit)[-self.limit:]
+            # ties with the worst of them may still get in by city name
+            idx = np.flatnonzero(scores >= scores[idx].min())
+        else:
+            idx = np.arange(len(scores))
+        if self.cutoff is not None:
+            idx = idx[scores[idx] >= self.cutoff]
+
+        cities = self.len_to_cities[n]
+        for i in idx.tolist():
+            item = (float(scores[i]), cities[i if columns is None else int(columns[i])])
+            if len(self.best) < self.limit:
+                heapq.heappush(self.best, item)
+            elif item > self.best[0]:
+                heapq.heapreplace(self.best, item)
+
+    def results(self) -> List[Tuple[float, str]]:
+        return sorted(self.best, reverse=True)
+
+
+def search_levenshtein_banded(input_text: str, len_to_cities: Dict[int, Sequence[str]],
+                              len_to_mat: Dict[int, np.ndarray], limit: int = 10,
+                              len_to_alive: Optional[Dict[int, Optional[np.ndarray]]] = None) -> List[Tuple[float, str]]:
+    """
+    Return `limit` best (score, city) pairs, same as sorting all cities by score
+
+    The score is 1 - distance/max(n, m) as in interact_cities_levenshtein_vec().
+    Buckets with length closest to the query go first; once there are `limit`
+    results, the worst of them is the cutoff, which gives the largest distance
+    worth computing in the next bucket (lengths differing by more are skipped
+    altogether). Optionally, `len_to_alive` gives a mask of strings to search in
+    each bucket (None for all), see MutableFuzzyIndex.
+    """
+    a = np.asarray([ord(c) for c in input_text])
+    n = len(input_text)
+    top = TopK(len_to_cities, limit)
+
+    for m in sorted(len_to_mat, key=lambda m: (abs(m - n), m)):
+        longer = max(n, m)
+        if top.cutoff is None:
+            max_distance = longer
+        else:
+            # results with the same score as the cutoff may still get in, by city name
+            max_distance = int(np.floor((1.0 - top.cutoff) * longer + 1e-9))
+            if abs(m - n) > max_distance:
+                continue
+
+        alive = len_to_alive.get(m) if len_to_alive else None
+        if alive is None:
+            # strings further than max_distance score below the cutoff, so they don't get in
+            dist = levenshtein_distance_banded(a, len_to_mat[m], max_distance)
+            top.add(m, 1.0 - dist / longer)
+        else:
+            columns = np.flatnonzero(alive)
+            if len(columns):
+                dist = levenshtein_distance_banded(a, len_to_mat[m][:, columns], max_distance)
+                top.add(m, 1.0 - dist / longer, columns)
+
+    return top.results()
+
+def next_row(row: np.ndarray, b: np.ndarray, c: int, i: int) -> np.ndarray:
+    """
+    Return row i of the DP table given row i-1 and query character c = a[i-1]
+
+    Rows hold levenshtein_distance(a[:i], b[:j]) for j = 0..n as (n+1, k) int16 arrays.
+    Unlike the other functions, there's no loop over cells: substitution and insertion
+    come from the row above, and a chain of deletions from the left is a running
+    minimum, d[i, j] = j + min over l <= j of (t[l] - l).
+    """
+    t = np.empty_like(row)
+    t[0] = i
+    np.add(row[1:], 1, out=t[1:])                                  # insert into B      ↓
+    np.minimum(t[1:], row[:-1] + (b != c), out=t[1:])              # substitute         ↘
+    j = np.arange(len(row), dtype=row.dtype)[:, np.newaxis]
+    t -= j
+    np.minimum.accumulate(t, axis=0, out=t)                        # delete from B      →
+    t += j
+    return t
+
+
+class SearchSession:
+    """
+    Search-as-you-type, reusing work done for the previous query
+
+    When the query grows by one character, only one new DP row is computed
+    for each bucket (see next_row()); the rows for the previous characters are
+    cached. Deleting characters just drops rows from the cache, so that the cost
+    of a keystroke doesn't depend on the length of the query. Memory taken is
+    one row per bucket, ie. about (average length + 1) * 2 bytes per string,
+    for every character of the query.
+    """
+
+    def __init__(self, len_to_cities: Dict[int, Sequence[str]], len_to_mat: Dict[int, np.ndarray]):
+        self.len_to_cities = len_to_cities
+        self.len_to_mat = len_to_mat
+        self.query = ""
+        self.rows: Dict[int, List[np.ndarray]] = {}  # length -> DP row for each prefix of the query
+        for n, b in len_to_mat.items():
+            first = np.empty((n+1, b.shape[1]), dtype=np.int16)
+            first[:] = np.arange(n+1, dtype=np.int16)[:, np.newaxis]
+            self.rows[n] = [first]
+
+    def set_query(self, input_text: str):
+        common = 0
+        for x, y in zip(self.query, input_text):
+            if x != y:
+                break
+            common += 1
+        for rows in self.rows.values():
+            del rows[common+1:]
+        for i in range(common + 1, len(input_text) + 1):
+            c = ord(input_text[i-1])
+            for n, rows in self.rows.items():
+                rows.append(next_row(rows[-1], self.len_to_mat[n], c, i))
+        self.query = input_text
+
+    def distances(self, n: int) -> np.ndarray:
+        """Return Levenshtein distance of current query to strings of length n"""
+        return self.rows[n][-1][n]
+
+    def search(self, input_text: str, limit: int = 10) -> List[Tuple[float, str]]:
+        """Return `limit` best (score, city) pairs, scored as in interact_cities_levenshtein_vec()"""
+        self.set_query(input_text)
+        if not input_text:
+            return []
+
+        top = TopK(self.len_to_cities, limit)
+        for n in self.len_to_cities:
+            top.add(n, 1.0 - self.distances(n) / max(len(input_text), n))
+        return top.results()
+
+def search_batch(queries: Iterable[str], len_to_cities: Dict[int, Sequence[str]], len_to_mat: Dict[int, np.ndarray],
+                 limit: int = 10, chunk_size: int = 1024, block_pairs: int = 2**16) -> Iterator[List[Tuple[float, str]]]:
+    """
+    Yield `limit` best (score, city) pairs for each query, in order of queries
+
+    Like rapidfuzz.process.cdist(), this is meant for many queries at once. Queries are taken
+    `chunk_size` at a time and grouped by length, so that a group of m-character queries and
+    a bucket of n-character strings make a (m, g) and (n, k) matrix, and their distances are
+    computed together with levenshtein_distance_cdist(), in blocks of at most `block_pairs` pairs.
+    Only the best of each block go to per-query heaps (like in TopK), so memory taken
+    doesn't depend on the number of queries.
+
+    Buckets with length closest to the query go first; once every query in the group has
+    `limit` results, buckets too long or too short to beat them are skipped.
+    """
+    queries = iter(queries)
+    while True:
+        chunk = list(itertools.islice(queries, chunk_size))
+        if not chunk:
+            return
+        best: List[List[Tuple[float, str]]] = [[] for _ in chunk]  # min-heap for each query
+        cutoffs = np.full(len(chunk), -np.inf)  # worst score of full heaps
+
+        groups: Dict[int, List[int]] = {}
+        for i, input_text in enumerate(chunk):
+            if input_text:
+                groups.setdefault(len(input_text), []).append(i)
+
+        for m, group in groups.items():
+            group = np.asarray(group)
+            a = np.asarray([[ord(c) for c in chunk[i]] for i in group], dtype=np.uint32).T  # (m, g)
+            for n in sorted(len_to_mat, key=lambda n: (abs(n - m), n)):
+                longer = max(n, m)
+                max_distance = np.floor((1.0 - cutoffs[group]) * longer + 1e-9)
+                active = np.flatnonzero(max_distance >= abs(n - m))
+                if len(active) == 0:
+                    continue
+
+                b = len_to_mat[n]
+                kb = min(b.shape[1], block_pairs)
+                gb = max(1, block_pairs // kb)
+                for g0 in range(0, len(active), gb):
+                    rows = active[g0:g0 + gb]
+                    for k0 in range(0, b.shape[1], kb):
+                        scores = 1.0 - levenshtein_distance_cdist(a[:, rows], b[:, k0:k0 + kb]) / longer
+                        collect_block(scores, group[rows], k0, best, cutoffs, len_to_cities[n], limit)
+
+        for i in range(len(chunk)):
+            yield sorted(best[i], reverse=True)
+
+
+def collect_block(scores: np.ndarray, query_ids: np.ndarray, first_column: int, best: List[List[Tuple[float, str]]],
+                  cutoffs: np.ndarray, cities: Sequence[str], limit: int):
+    """Merge (queries, strings) block of scores into heaps of given queries, see search_batch()"""
+    if scores.shape[1] > limit:
+        idx = np.argpartition(scores, -limit, axis=1)[:, -limit:]
+        # ties with the worst of them may still get in by city name
+        threshold = np.take_along_axis(scores, idx, axis=1).min(axis=1)
+    else:
+        threshold = scores.min(axis=1)
+    threshold = np.maximum(threshold, cutoffs[query_ids])
+    for r, col in zip(*np.nonzero(scores >= threshold[:, np.newaxis])):
+        q = int(query_ids[r])
+        item = (float(scores[r, col]), cities[first_column + int(col)])
+        if len(best[q]) < limit:
+            heapq.heappush(best[q], item)
+        elif item > best[q][0]:
+            heapq.heapreplace(best[q], item)
+        if len(best[q]) == limit:
+            cutoffs[q] = best[q][0][0]
+
+# ----------------------------------------------------------------------
+# PERSISTENT INDEX
+# ----------------------------------------------------------------------
+#
+# Parsing the CSV and converting strings to matrices takes seconds, so it can be
+# done once and saved into a file, which is then memory-mapped by search processes.
+# Loading takes milliseconds and processes using the same file share its pages.
+# The file starts with a header:
+#
+#   magic b"FUZZYIDX", version (u32), number of strings (u64), number of buckets (u64),
+#   position of string data (u64)
+#
+# followed by sections, each aligned to 8 bytes:
+#
+#   buckets: (length, number of strings, id of first string, position of codes) as i64
+#   offsets: n_strings+1 values (i64), string i is data[offsets[i]:offsets[i+1]]
+#   codes: (length, number of strings) matrix of code points (u16) for each bucket
+#   data: UTF-8 encoded strings, ordered by bucket
+
+INDEX_MAGIC = b"FUZZYIDX"
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct("<8sIxxxxQQQ")
+
+
+def align(pos: int) -> int:
+    return (pos + 7) // 8 * 8
+
+
+def to_matrix(strings: Sequence[str], n: int) -> np.ndarray:
+    """Return (n, k) matrix of code points of k strings of length n, like len_to_mat in the notebook"""
+    codes = np.frombuffer("".join(strings).encode("utf-32-le"), dtype="<u4").reshape(len(strings), n)
+    if codes.size and codes.max() > np.iinfo(np.uint16).max:
+        raise ValueError("Only characters from the Basic Multilingual Plane are supported")
+    return np.ascontiguousarray(codes.T, dtype=np.uint16)
+
+
+class StringTable(Sequence[str]):
+    """Read-only list of strings, kept as UTF-8 bytes and offsets (eg. in a memory-mapped file)"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        i = range(len(self))[i]
+        return self.data[self.offsets[i]:self.offsets[i+1]].tobytes().decode("utf-8")
+
+
+class FuzzyIndex:
+    """
+    Strings bucketed by length, with the same `len_to_cities` and `len_to_mat` as in the notebook
+
+    Create it from strings with FuzzyIndex.build(), or from a file written
+    by save() with FuzzyIndex.load().
+    """
+
+    def __init__(self, len_to_cities: Dict[int, Sequence[str]], len_to_mat: Dict[int, np.ndarray]):
+        self.len_to_cities = len_to_cities
+        self.len_to_mat = len_to_mat
+
+    def __len__(self) -> int:
+        return sum(len(strings) for strings in self.len_to_cities.values())
+
+    @classmethod
+    def build(cls, strings: Iterable[str]) -> "FuzzyIndex":
+        len_to_cities: Dict[int, List[str]] = {}
+        for w in dict.fromkeys(strings):  # without duplicates
+            len_to_cities.setdefault(len(w), []).append(w)
+        len_to_cities = {n: len_to_cities[n] for n in sorted(len_to_cities)}
+        return cls(len_to_cities, {n: to_matrix(ws, n) for n, ws in len_to_cities.items()})
+
+    def save(self, path: str):
+        lengths = sorted(self.len_to_mat)
+        encoded = [w.encode("utf-8") for n in lengths for w in self.len_to_cities[n]]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(w) for w in encoded])
+
+        buckets = np.zeros((len(lengths), 4), dtype=np.int64)
+        pos = align(INDEX_HEADER.size + buckets.nbytes + offsets.nbytes)
+        first = 0
+        for row, n in zip(buckets, lengths):
+            count = len(self.len_to_cities[n])
+            row[:] = n, count, first, pos
+            first += count
+            pos = align(pos + 2*n*count)
+        data_pos = pos
+
+        with open(path, "wb") as fp:
+            def write_at(pos: int, data: bytes):
+                fp.write(bytes(pos - fp.tell()))  # padding
+                fp.write(data)
+
+            write_at(0, INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(encoded), len(lengths), data_pos))
+            fp.write(buckets.tobytes())
+            fp.write(offsets.tobytes())
+            for n, (_, _, _, codes_pos) in zip(lengths, buckets):
+                write_at(codes_pos, np.ascontiguousarray(self.len_to_mat[n], dtype="<u2").tobytes())
+            write_at(data_pos, b"".join(encoded))
+
+    @classmethod
+    def load(cls, path: str) -> "FuzzyIndex":
+        """Memory-map index file written by save(), nothing is read until it's needed"""
+        raw = np.memmap(path, dtype=np.uint8, mode="r").view(np.ndarray)
+        magic, version, n_strings, n_buckets, data_pos = INDEX_HEADER.unpack_from(raw)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError("Not a fuzzy search index (or unsupported version)")
+
+        pos = INDEX_HEADER.size
+        buckets = raw[pos:pos + 32*n_buckets].view("<i8").reshape(n_buckets, 4)
+        pos += buckets.nbytes
+        offsets = raw[pos:pos + 8*(n_strings+1)].view("<i8")
+        data = raw[data_pos:]
+
+        len_to_cities: Dict[int, Sequence[str]] = {}
+        len_to_mat: Dict[int, np.ndarray] = {}
+        for n, count, first, codes_pos in buckets.tolist():
+            len_to_mat[n] = raw[codes_pos:codes_pos + 2*n*count].view("<u2").reshape(n, count)
+            len_to_cities[n] = StringTable(data, offsets[first:first + count + 1])
+        return cls(len_to_cities, len_to_mat)
+
+
+def read_cities(path: str, column: str = "place15nm") -> List[str]:
+    """Return unique values of given column of the CSV file, eg. the dataset used in the notebook"""
+    with open(path, newline="", encoding="utf-8-sig") as fp:
+        return list(dict.fromkeys(row[column] for row in csv.DictReader(fp)))
+
+
+# ----------------------------------------------------------------------
+# MUTABLE INDEX
+# ----------------------------------------------------------------------
+
+class IndexSnapshot(FuzzyIndex):
+    """
+    Read-only view of MutableFuzzyIndex at one point in time
+
+    Arrays of a snapshot are never modified, so searches using it see the same strings
+    even while the index is being updated. Removed strings are still in `len_to_cities`
+    and `len_to_mat` until compaction, `len_to_alive` masks them out (None if the whole
+    bucket is alive).
+    """
+
+    def __init__(self, len_to_cities: Dict[int, Sequence[str]], len_to_mat: Dict[int, np.ndarray],
+                 len_to_alive: Dict[int, Optional[np.ndarray]]):
+        super().__init__(len_to_cities, len_to_mat)
+        self.len_to_alive = len_to_alive
+
+    def __len__(self) -> int:
+        return sum(len(strings) if self.len_to_alive[n] is None else int(np.count_nonzero(self.len_to_alive[n]))
+                   for n, strings in self.len_to_cities.items())
+
+    def __iter__(self) -> Iterator[str]:
+        for n, strings in self.len_to_cities.items():
+            alive = self.len_to_alive[n]
+            for i in range(len(strings)) if alive is None else np.flatnonzero(alive).tolist():
+                yield strings[i]
+
+    def search(self, input_text: str, limit: int = 10) -> List[Tuple[float, str]]:
+        return search_levenshtein_banded(input_text, self.len_to_cities, self.len_to_mat, limit, self.len_to_alive)
+
+    def save(self, path: str):
+        """Save strings which are alive as an index file, see FuzzyIndex.load()"""
+        FuzzyIndex.build(self).save(path)
+
+
+class MutableFuzzyIndex:
+    """
+    Fuzzy index with strings added and removed while it's being searched
+
+    Each bucket is a matrix with spare columns which doubles in size when full,
+    so adding a string usually means writing one column. Removing a string only marks
+    it as dead (a tombstone); once more than `compact_ratio` of a bucket is dead,
+    it's copied without them.
+
+    Searches don't take any locks: `snapshot` is replaced with a new IndexSnapshot after
+    each update, and arrays visible through a published snapshot are never written to
+    (new columns go past its end, tombstones and compaction go into copies). A search
+    which took the previous snapshot keeps a consistent view until it's done.
+    Updates are serialized with a lock.
+    """
+
+    def __init__(self, strings: Iterable[str] = (), compact_ratio: float = 0.25):
+        self.compact_ratio = compact_ratio
+        self.lock = threading.Lock()
+        self.mats: Dict[int, np.ndarray] = {}     # length -> (n, capacity) matrix
+        self.cities: Dict[int, np.ndarray] = {}   # length -> (capacity,) array of strings
+        self.alive: Dict[int, np.ndarray] = {}    # length -> (capacity,) bool array
+        self.sizes: Dict[int, int] = {}           # length -> number of used columns
+        self.dead: Dict[int, int] = {}            # length -> number of tombstones
+        self.positions: Dict[str, int] = {}       # string -> column in its bucket, for strings alive
+        self.unpublished: Set[int] = set()        # buckets with `alive` arrays not in any snapshot yet
+        self.snapshot = IndexSnapshot({}, {}, {})
+        self.update(add=strings)
+
+    @classmethod
+    def load(cls, path: str, compact_ratio: float = 0.25) -> "MutableFuzzyIndex":
+        """Load strings from index file written by FuzzyIndex.save()"""
+        index = cls(compact_ratio=compact_ratio)
+        index.reload(path)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, string: str) -> bool:
+        return string in self.positions
+
+    def add(self, *strings: str):
+        self.update(add=strings)
+
+    def remove(self, *strings: str):
+        self.update(remove=strings)
+
+    def update(self, add: Iterable[str] = (), remove: Iterable[str] = ()):
+        """Remove and add strings (unknown or duplicate strings are ignored), then publish a new snapshot"""
+        with self.lock:
+            for string in remove:
+                self.remove_string(string)
+            new: Dict[int, List[str]] = {}
+            for string in dict.fromkeys(add):
+                if string not in self.positions:
+                    new.setdefault(len(string), []).append(string)
+            for n, strings in new.items():
+                self.append(n, strings)
+            for n in [n for n in self.dead if self.dead[n] > self.compact_ratio * self.sizes[n]]:
+                self.compact_bucket(n)
+            self.publish()
+
+    def reload(self, path: str):
+        """Replace all strings with those from index file written by FuzzyIndex.save()"""
+        index = FuzzyIndex.load(path)
+        with self.lock:
+            self.mats, self.cities, self.alive, self.sizes, self.dead, self.positions = {}, {}, {}, {}, {}, {}
+            self.unpublished = set()
+            for n in index.len_to_mat:
+                self.append(n, list(index.len_to_cities[n]), np.asarray(index.len_to_mat[n]))
+            self.publish()
+
+    def compact(self):
+        with self.lock:
+            for n in list(self.dead):
+                self.compact_bucket(n)
+            self.publish()
+
+    def append(self, n: int, strings: List[str], codes: Optional[np.ndarray] = None):
+        if codes is None:
+            codes = to_matrix(strings, n)
+        if n not in self.mats or self.sizes[n] + len(strings) > self.mats[n].shape[1]:
+            self.grow(n, max(16, 2 * (self.sizes.get(n, 0) - self.dead.get(n, 0) + len(strings))))
+        size = self.sizes[n]
+        self.mats[n][:, size:size + len(strings)] = codes
+        self.cities[n][size:size + len(strings)] = strings
+        self.alive[n][size:size + len(strings)] = True
+        for i, string in enumerate(strings, start=size):
+            self.positions[string] = i
+        self.sizes[n] = size + len(strings)
+
+    def grow(self, n: int, capacity: int):
+        """Move bucket into new arrays with given capacity, keeping only live strings"""
+        mat = np.zeros((n, capacity), dtype=np.uint16)
+        cities = np.empty(capacity, dtype=object)
+        alive = np.zeros(capacity, dtype=bool)
+        if n in self.mats:
+            columns = np.flatnonzero(self.alive[n][:self.sizes[n]])
+            mat[:, :len(columns)] = self.mats[n][:, columns]
+            cities[:len(columns)] = self.cities[n][columns]
+            alive[:len(columns)] = True
+            for i, string in enumerate(cities[:len(columns)].tolist()):
+                self.positions[string] = i
+            self.sizes[n] = len(columns)
+        else:
+            self.sizes[n] = 0
+        self.mats[n], self.cities[n], self.alive[n] = mat, cities, alive
+        self.unpublished.add(n)
+        self.dead.pop(n, None)
+
+    def remove_string(self, string: str):
+        i = self.positions.pop(string, None)
+        if i is None:
+            return
+        n = len(string)
+        if n not in self.unpublished:
+            self.alive[n] = self.alive[n].copy()  # published snapshots may be using the old one
+            self.unpublished.add(n)
+        self.alive[n][i] = False
+        self.dead[n] = self.dead.get(n, 0) + 1
+
+    def compact_bucket(self, n: int):
+        live = self.sizes[n] - self.dead.get(n, 0)
+        if live == 0:
+            for d in (self.mats, self.cities, self.alive, self.sizes, self.dead):
+                d.pop(n, None)
+        else:
+            self.grow(n, max(16, 2 * live))
+
+    def publish(self):
+        len_to_cities: Dict[int, Sequence[str]] = {}
+        len_to_mat: Dict[int, np.ndarray] = {}
+        len_to_alive: Dict[int, Optional[np.ndarray]] = {}
+        for n in sorted(self.mats):
+            size = self.sizes[n]
+            len_to_cities[n] = self.cities[n][:size]
+            len_to_mat[n] = self.mats[n][:, :size]
+            len_to_alive[n] = self.alive[n][:size] if self.dead.get(n) else None
+        self.unpublished.clear()
+        self.snapshot = IndexSnapshot(len_to_cities, len_to_mat, len_to_alive)
+
+
+# ----------------------------------------------------------------------
+# Q-GRAM INDEX
+# ----------------------------------------------------------------------
+
+def qgram_keys(codes: np.ndarray, q: int) -> np.ndarray:
+    """
+    Return q-grams of strings in columns of (n, k) matrix `codes`, as (n+q-1, k) array of integers
+
+    Strings are padded with q-1 zeros on both sides, so that short strings have
+    q-grams too and the first and last characters are in as many q-grams as the others.
+    Each q-gram is packed into one integer, 16 bits per character.
+    """
+    n, k = codes.shape
+    padded = np.zeros((n + 2*(q-1), k), dtype=np.uint64)
+    padded[q-1:q-1+n] = codes
+    keys = np.zeros((n + q - 1, k), dtype=np.uint64)
+    for i in range(q):
+        keys = (keys << np.uint64(16)) | padded[i:i + n + q - 1]
+    return keys
+
+
+class QGramIndex:
+    """
+    Inverted index from q-grams to strings, to find candidates before computing edit distance
+
+    Each edit changes at most q of the q-grams of a string (q-gram lemma), so a string within
+    distance k from the query must contain at least (number of distinct q-grams of the query) - k*q
+    of them. Counting how many query q-grams each string has only takes going through
+    the lists of strings for these q-grams, and the exact distance is then computed only for
+    strings which have enough of them. The index refers to strings by their position
+    in `index`, bucket after bucket in order of length.
+    """
+
+    def __init__(self, index: FuzzyIndex, q: int = 3):
+        if not 1 <= q <= 4:
+            raise ValueError("q must be between 1 and 4, so that a q-gram fits into 64 bits")
+        self.index = index
+        self.q = q
+        offsets = bucket_offsets(index.len_to_cities)
+        self.bucket_lengths = np.asarray(list(offsets), dtype=np.int64)
+        self.first_ids = np.asarray(list(offsets.values()), dtype=np.int64)
+        counts = np.asarray([len(index.len_to_cities[n]) for n in offsets], dtype=np.int64)
+        self.lengths = np.repeat(self.bucket_lengths, counts)  # string id -> length
+
+        keys, ids = [], []
+        for n, first, count in zip(self.bucket_lengths.tolist(), self.first_ids.tolist(), counts.tolist()):
+            bucket_keys = qgram_keys(np.asarray(index.len_to_mat[n]), q)
+            keys.append(bucket_keys.ravel())
+            ids.append(np.broadcast_to(np.arange(first, first + count, dtype=np.int32), bucket_keys.shape).ravel())
+        keys, ids = np.concatenate(keys), np.concatenate(ids)
+
+        # sort (q-gram, string) pairs and drop repeated q-grams of the same string
+        order = np.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        distinct = np.ones(len(keys), dtype=bool)
+        distinct[1:] = (keys[1:] != keys[:-1]) | (ids[1:] != ids[:-1])
+        keys, ids = keys[distinct], ids[distinct]
+
+        # strings having q-gram self.keys[i] are self.postings[self.starts[i]:self.starts[i+1]]
+        self.keys, starts = np.unique(keys, return_index=True)
+        self.starts = np.append(starts, len(keys)).astype(np.int64)
+        self.postings = ids
+
+    def query_keys(self, input_text: str) -> np.ndarray:
+        codes = np.asarray([ord(c) for c in input_text], dtype=np.uint64).reshape(-1, 1)
+        return np.unique(qgram_keys(codes, self.q))
+
+    def shared(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return sorted ids of strings having any of given distinct q-grams, and how many of them each has"""
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < len(self.keys)
+        found[found] = self.keys[pos[found]] == keys[found]
+        postings = [self.postings[self.starts[i]:self.starts[i+1]] for i in pos[found]]
+        postings.append(np.zeros(0, dtype=np.int32))
+        return np.unique(np.concatenate(postings), return_counts=True)
+
+    def length_range(self, shortest: int, longest: int) -> np.ndarray:
+        """Return sorted ids of strings with shortest <= length <= longest (they are contiguous)"""
+        bounds = np.append(self.first_ids, len(self.lengths))
+        lo, hi = np.searchsorted(self.bucket_lengths, [shortest, longest + 1])
+        return np.arange(bounds[lo], bounds[hi])
+
+    def candidates(self, input_text: str, max_distance: int) -> np.ndarray:
+        """Return sorted ids of strings which may be within `max_distance` from the query"""
+        n = len(input_text)
+        keys = self.query_keys(input_text)
+        min_shared = len(keys) - max_distance * self.q
+        if min_shared <= 0:
+            return self.length_range(n - max_distance, n + max_distance)  # the filter can't rule anything out
+        ids, counts = self.shared(keys)
+        ids = ids[counts >= min_shared]
+        return ids[np.abs(self.lengths[ids] - n) <= max_distance]
+
+    def buckets(self, ids: np.ndarray) -> Iterable[Tuple[int, slice, np.ndarray]]:
+        """Yield (length, slice of `ids`, their columns in the bucket matrix) for sorted string ids"""
+        bounds = np.searchsorted(ids, np.append(self.first_ids, len(self.lengths)))
+        for b, n in enumerate(self.bucket_lengths.tolist()):
+            if bounds[b] < bounds[b+1]:
+                part = slice(int(bounds[b]), int(bounds[b+1]))
+                yield n, part, ids[part] - self.first_ids[b]
+
+    def search_within(self, input_text: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Return all (distance, city) pairs within `max_distance` from the query, closest first"""
+        a = np.asarray([ord(c) for c in input_text])
+        results = []
+        for n, _, columns in self.buckets(self.candidates(input_text, max_distance)):
+            dist = levenshtein_distance_banded(a, np.asarray(self.index.len_to_mat[n])[:, columns], max_distance)
+            cities = self.index.len_to_cities[n]
+            results.extend((int(dist[i]), cities[columns[i]]) for i in np.flatnonzero(dist <= max_distance))
+        return sorted(results)
+
+    def search(self, input_text: str, limit: int = 10) -> List[Tuple[float, str]]:
+        """
+        Return `limit` best (score, city) pairs, same as search_levenshtein_banded()
+
+        The number of shared q-grams gives a lower bound of distance for each string.
+        Strings are scored in order of the bound, stopping once the `limit`-th result
+        is better than any string with a higher bound could be.
+        """
+        if not input_text:
+            return []
+        a = np.asarray([ord(c) for c in input_text])
+        n = len(input_text)
+        keys = self.query_keys(input_text)
+        top = TopK(self.index.len_to_cities, limit)
+
+        def score(ids: np.ndarray):
+            for m, _, columns in self.buckets(ids):
+                longer = max(n, m)
+                if top.cutoff is None:
+                    max_distance = longer
+                else:
+                    max_distance = int(np.floor((1.0 - top.cutoff) * longer + 1e-9))
+                dist = levenshtein_distance_banded(a, np.asarray(self.index.len_to_mat[m])[:, columns], max_distance)
+                top.add(m, 1.0 - dist / longer, columns)
+
+        # only strings sharing some q-gram are looked at one by one, the rest are taken
+        # from whole length ranges when the search gets to their (common) bound
+        shared_ids, counts = self.shared(keys)
+        lower = np.maximum(-((counts - len(keys)) // self.q), np.abs(self.lengths[shared_ids] - n))
+        order = np.argsort(lower, kind="stable")
+        level_bounds = np.searchsorted(lower[order], np.arange(int(lower.max(initial=0)) + 2))
+        zero_bound = -(-len(keys) // self.q)  # bound of strings without shared q-grams
+        max_bound = max(len(level_bounds) - 2, zero_bound,
+                        int(max(n - self.bucket_lengths.min(), self.bucket_lengths.max() - n)))
+
+        def level(t: int) -> np.ndarray:
+            """Return ids of strings whose lower bound of distance is t"""
+            ids = [shared_ids[order[level_bounds[t]:level_bounds[t+1]]]] if t + 1 < len(level_bounds) else []
+            if t >= zero_bound:
+                for shortest, longest in [(n - t, n + t)] if t == zero_bound else [(n - t, n - t), (n + t, n + t)]:
+                    in_range = self.length_range(shortest, longest)
+                    if len(in_range):
+                        lo, hi = np.searchsorted(shared_ids, [in_range[0], in_range[-1] + 1])
+                        ids.append(np.setdiff1d(in_range, shared_ids[lo:hi], assume_unique=True))
+            return np.concatenate(ids) if ids else np.zeros(0, dtype=np.int64)
+
+        # Score the lowest levels until there are `limit` strings, then everything which may still
+        # beat the `limit`-th result - strings at level t score at most 1 - t/(n+t). Levels are
+        # batched, since each call to levenshtein_distance_banded() has a cost of its own.
+        t = 0
+        while t <= max_bound:
+            levels = []
+            if top.cutoff is None:
+                while t <= max_bound and sum(map(len, levels)) < limit:
+                    levels.append(level(t))
+                    t += 1
+            else:
+                while t <= max_bound and not top.cutoff > 1.0 - t / (n + t):
+                    levels.append(level(t))
+                    t += 1
+                if not levels:
+                    break
+            score(np.sort(np.concatenate(levels)))
+
+        return top.results()
+
+
+# ----------------------------------------------------------------------
+# TRIE
+# ----------------------------------------------------------------------
+
+class TrieIndex:
+    """
+    Trie of strings for finding all strings within given distance from the query
+
+    Strings with a common prefix (eg. "Upper ...") share the DP rows for it: each trie node
+    gets one row, levenshtein_distance(node prefix, a[:j]) for j = 0..len(a), computed from the
+    row of its parent. The smallest value in a row never decreases further down, so once it's
+    above `max_distance`, the whole subtree is skipped.
+
+    The trie is stored level by level: node `i` at depth `d` has character `chars[d][i]` and its
+    children are nodes `first_child[d][i]` to `first_child[d][i+1]-1` at depth d+1. Search goes
+    level by level too, so that rows for all nodes at the same depth are computed at once
+    with next_row().
+    """
+
+    def __init__(self, strings: Iterable[str]):
+        self.strings = sorted(set(strings))
+        chars: List[List[int]] = [[0]]
+        parents: List[List[int]] = [[-1]]
+        ends: List[List[int]] = [[-1]]  # index into self.strings if a string ends at the node
+        path = [0]  # node index at each depth for prefixes of the previous string
+
+        previous = ""
+        for idx, s in enumerate(self.strings):
+            common = 0
+            for x, y in zip(previous, s):
+                if x != y:
+                    break
+                common += 1
+            del path[common+1:]
+            for d in range(common + 1, len(s) + 1):
+                if d == len(chars):
+                    chars.append([])
+                    parents.append([])
+                    ends.append([])
+                chars[d].append(ord(s[d-1]))
+                parents[d].append(path[-1])
+                ends[d].append(-1)
+                path.append(len(chars[d]) - 1)
+            ends[len(s)][path[-1]] = idx
+            previous = s
+
+        self.chars = [np.asarray(level, dtype=np.int32) for level in chars]
+        self.ends = [np.asarray(level, dtype=np.int32) for level in ends]
+        # nodes are created in sorted order, so children of each node are next to each other
+        self.first_child = [np.searchsorted(np.asarray(parents[d+1], dtype=np.int32), np.arange(len(chars[d]) + 1))
+                            for d in range(len(chars) - 1)]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def search_within(self, input_text: str, max_distance: int) -> List[Tuple[int, str]]:
+        """Return all (distance, city) pairs within `max_distance` from the query, closest first"""
+        a = np.asarray([ord(c) for c in input_text], dtype=np.int32)[:, np.newaxis]
+        n = len(input_text)
+        rows = np.arange(n+1, dtype=np.int16)[:, np.newaxis]  # one column for each active node
+        nodes = np.zeros(1, dtype=np.int64)
+        results = []
+        if n <= max_distance and self.ends[0][0] >= 0:
+            results.append((n, self.strings[self.ends[0][0]]))
+
+        for d in range(1, len(self.chars)):
+            # children of active nodes and index of their parent in `rows`
+            starts = self.first_child[d-1][nodes]
+            counts = self.first_child[d-1][nodes + 1] - starts
+            parent = np.repeat(np.arange(len(nodes)), counts)
+            nodes = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - starts, counts)
+            if len(nodes) == 0:
+                break
+
+            rows = next_row(rows[:, parent], a, self.chars[d][nodes][np.newaxis, :], d)
+            ends = self.ends[d][nodes]
+            for i in np.flatnonzero((ends >= 0) & (rows[n] <= max_distance)):
+                results.append((int(rows[n, i]), self.strings[ends[i]]))
+
+            alive = rows.min(axis=0) <= max_distance
+            rows, nodes = rows[:, alive], nodes[alive]
+
+        return sorted(results)
+
+
+# ----------------------------------------------------------------------
+# PARALLEL SEARCH
+# ----------------------------------------------------------------------
+
+Slice = Tuple[int, int, int]  # bucket length, first and last+1 column
+
+worker_index: Optional[FuzzyIndex] = None  # index opened by each worker process
+
+
+def init_worker(path: str):
+    global worker_index
+    worker_index = FuzzyIndex.load(path)
+
+
+def search_slices(index: FuzzyIndex, input_text: str, slices: Sequence[Slice], limit: int) -> List[Tuple[float, str]]:
+    """Return `limit` best (score, city) pairs from given slices of buckets, like search_levenshtein_banded()"""
+    a = np.asarray([ord(c) for c in input_text])
+    n = len(input_text)
+    top = TopK(index.len_to_cities, limit)
+    for m, start, stop in sorted(slices, key=lambda s: (abs(s[0] - n), s)):
+        longer = max(n, m)
+        if top.cutoff is None:
+            max_distance = longer
+        else:
+            max_distance = int(np.floor((1.0 - top.cutoff) * longer + 1e-9))
+            if abs(m - n) > max_distance:
+                continue
+        dist = levenshtein_distance_banded(a, index.len_to_mat[m][:, start:stop], max_distance)
+        top.add(m, 1.0 - dist / longer, np.arange(start, stop))
+    return top.results()
+
+
+def search_slices_in_worker(input_text: str, slices: Sequence[Slice], limit: int) -> List[Tuple[float, str]]:
+    return search_slices(worker_index, input_text, slices, limit)
+
+
+class ParallelSearch:
+    """
+    Search an index file with a pool of worker processes (or threads)
+
+    Buckets are split into tasks with about the same number of characters to compare,
+    cutting large buckets into slices of columns, so that all workers finish at about
+    the same time. Each worker opens the index file once; it's memory-mapped, so the
+    matrices are shared by all processes through the page cache and nothing is copied
+    per query, only the query and task ranges go in and `limit` results per task come out.
+    Results are the same as with search_levenshtein_banded(), though each task has its own
+    cutoff, so more distances are computed in total.
+
+    Threads avoid the overhead of sending tasks to other processes, but only run
+    in parallel while NumPy releases the GIL, ie. for large arrays.
+    """
+
+    def __init__(self, path: str, n_workers: Optional[int] = None, use_threads: bool = False,
+                 tasks_per_worker: int = 2):
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.index = FuzzyIndex.load(path)
+        self.executor: Executor
+        if use_threads:
+            self.executor = ThreadPoolExecutor(self.n_workers)
+        else:
+            self.executor = ProcessPoolExecutor(self.n_workers, initializer=init_worker, initargs=(path,))
+        self.use_threads = use_threads
+        self.tasks = self.split(self.n_workers * tasks_per_worker)
+
+    def split(self, n_tasks: int) -> List[List[Slice]]:
+        """Split buckets into `n_tasks` lists of slices with about the same work each"""
+        work = {n: max(n, 1) * len(self.index.len_to_cities[n]) for n in self.index.len_to_mat}
+        target = math.ceil(sum(work.values()) / n_tasks)
+        tasks: List[List[Slice]] = [[]]
+        task_work = 0
+        for n in sorted(work):
+            k = len(self.index.len_to_cities[n])
+            start = 0
+            while start < k:
+                stop = min(k, start + math.ceil((target - task_work) / max(n, 1)))
+                tasks[-1].append((n, start, stop))
+                task_work += (stop - start) * max(n, 1)
+                start = stop
+                if task_work >= target:
+                    tasks.append([])
+                    task_work = 0
+        return [task for task in tasks if task]
+
+    def search(self, input_text: str, limit: int = 10) -> List[Tuple[float, str]]:
+        """Return `limit` best (score, city) pairs, merged from results of all tasks"""
+        if not input_text:
+            return []
+        if self.use_threads:
+            futures = [self.executor.submit(search_slices, self.index, input_text, task, limit) for task in self.tasks]
+        else:
+            futures = [self.executor.submit(search_slices_in_worker, input_text, task, limit) for task in self.tasks]
+        return heapq.nlargest(limit, itertools.chain.from_iterable(f.result() for f in futures))
+
+    def close(self):
+        self.executor.shutdown()
+
+    def __enter__(self) -> "ParallelSearch":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# ----------------------------------------------------------------------
+# WRATIO SCORER
+# ----------------------------------------------------------------------
+#
+# fuzz.WRatio from rapidfuzz/fuzzywuzzy, which the notebook uses first, combines
+# several scores based on the Indel distance (insertions and deletions only), ie. on
+# the length of the longest common subsequence (LCS): ratio = 100 * 2*LCS / (m + n).
+# Depending on how the lengths of the two strings compare, it takes the best of ratio,
+# ratio of token-sorted strings, of token sets, and partial ratio (best match of the
+# shorter string to a part of the longer one) of these.
+
+NON_ALPHANUMERIC = re.compile(r"[\W_]")
+UNBASE_SCALE = 0.95
+
+
+def default_process(text: str) -> str:
+    """Replace non-alphanumeric characters with spaces, trim and lowercase, like rapidfuzz.utils.default_process()"""
+    return NON_ALPHANUMERIC.sub(" ", text).strip().lower()
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    """Number of set bits in each uint64 (np.bitwise_count() needs NumPy 2.0)"""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def lcs_length_cdist(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Length of longest common subsequence of each column of `a` (m, g) and each column of `b` (n, k), as (g, k) matrix
+
+    Bit-parallel like levenshtein_distance_cdist() (Allison-Dix, Hyyrö): zero bits of V mark
+    positions of `a` where the LCS grows, and each character of `b` updates V with
+    V = (V + U) | (V - U), where U = V & peq[character]. For strings longer than 64 characters,
+    the addition carries over to the next word. Code 0 matches nothing, so strings can be
+    padded with zeros.
+    """
+    (m, g), (n, k) = a.shape, b.shape
+    if m == 0 or n == 0:
+        return np.zeros((g, k), dtype=np.int64)
+    n_blocks = (m + WORD_SIZE - 1) // WORD_SIZE
+    peq, n_chars, b_chars = match_bits(a, b)
+    pair_offset = np.repeat(np.arange(g) * n_chars, k)
+
+    v = np.full((n_blocks, g * k), ~ZERO)
+    for j in range(n):
+        chars = pair_offset + np.tile(b_chars[j], g) if g > 1 else b_chars[j]
+        carry = ZERO
+        for block in range(n_blocks):
+            u = v[block] & peq[block, chars]
+            total = v[block] + u
+            if block < n_blocks - 1:
+                carry_out = (total < u).astype(np.uint64)
+                total += carry
+                carry_out |= (total < carry).astype(np.uint64)
+            else:
+                total += carry
+            v[block] = total | (v[block] & ~u)  # U is a subset of V, so V - U = V & ~U
+            if block < n_blocks - 1:
+                carry = carry_out
+
+    lcs = np.zeros(g * k, dtype=np.int64)
+    for block in range(n_blocks):
+        bits = min(WORD_SIZE, m - block * WORD_SIZE)
+        mask = ~ZERO if bits == WORD_SIZE else (ONE << np.uint64(bits)) - ONE
+        lcs += popcount(~v[block] & mask).astype(np.int64)
+    return lcs.reshape(g, k)
+
+
+def windows(codes: np.ndarray, width: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return parts of strings in columns of (n, k) matrix `codes` which partial ratio compares
+    with a string of length `width` <= n: prefixes shorter than `width`, all substrings of
+    length `width` and suffixes shorter than `width`.
+
+    Parts are returned as (width, n_parts, k) array, padded with zeros, and their lengths.
+    """
+    n, k = codes.shape
+    padded = np.zeros((n + 2*width, k), dtype=codes.dtype)
+    padded[width:width + n] = codes
+    starts = np.arange(1 - width, n)
+    parts = padded[(starts + width)[np.newaxis, :] + np.arange(width)[:, np.newaxis]]
+    return parts, np.minimum(starts + width, n) - np.maximum(starts, 0)
+
+
+def indel_ratio(lcs: np.ndarray, lensum: np.ndarray) -> np.ndarray:
+    """100 * normalized Indel similarity, Indel distance being lensum - 2*lcs"""
+    return 100.0 * (1.0 - (lensum - 2*lcs) / lensum)
+
+
+Buckets = Dict[int, Tuple[np.ndarray, np.ndarray]]  # length -> (n, k) matrix of strings, their ids
+
+
+def bucket_strings(strings: Sequence[str]) -> Buckets:
+    len_to_ids: Dict[int, List[int]] = {}
+    for i, s in enumerate(strings):
+        len_to_ids.setdefault(len(s), []).append(i)
+    return {n: (to_matrix([strings[i] for i in ids], n), np.asarray(ids))
+            for n, ids in sorted(len_to_ids.items()) if n > 0}
+
+
+class WRatioScorer:
+    """
+    Scores a query against all strings like rapidfuzz.fuzz.WRatio(query, s, processor=default_process)
+
+    Preprocessing (default_process(), sorting tokens, token sets) is done once for all strings
+    when the scorer is created, not for each comparison. Each form is kept in buckets by length,
+    so that each score is computed for a whole bucket at once with lcs_length_cdist(); partial
+    ratio compares with all parts of the longer string at once, as extra columns.
+
+    Whether strings have tokens in common is found with an inverted index of tokens. Most strings
+    have none in common with the query, then token set ratio is just ratio of the token sets
+    and partial token ratio is partial ratio of token-sorted strings; if they have some,
+    partial token ratio is 100 and token set ratio is computed from the differences.
+    """
+
+    def __init__(self, strings: Sequence[str]):
+        self.strings = list(strings)
+        processed = [default_process(s) for s in self.strings]
+        tokens = [p.split() for p in processed]
+        self.token_sets = [sorted(set(t)) for t in tokens]
+        self.lengths = np.asarray([len(p) for p in processed])
+        self.set_sizes = np.asarray([len(ts) for ts in self.token_sets])
+        self.has_duplicates = np.asarray([len(t) != len(ts) for t, ts in zip(tokens, self.token_sets)])
+
+        self.processed = bucket_strings(processed)
+        self.sorted_tokens = bucket_strings([" ".join(sorted(t)) for t in tokens])
+        self.set_tokens = bucket_strings([" ".join(ts) for ts in self.token_sets])
+
+        # strings with token `vocabulary[t]` are self.postings[self.starts[t]:self.starts[t+1]]
+        self.vocabulary: Dict[str, int] = {}
+        pairs = [(self.vocabulary.setdefault(t, len(self.vocabulary)), i)
+                 for i, ts in enumerate(self.token_sets) for t in ts]
+        pairs_array = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        pairs_array = pairs_array[np.argsort(pairs_array[:, 0], kind="stable")]
+        self.starts = np.searchsorted(pairs_array[:, 0], np.arange(len(self.vocabulary) + 1))
+        self.postings = pairs_array[:, 1]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def shared_tokens(self, query_tokens: Sequence[str]) -> np.ndarray:
+        """Return number of distinct tokens each string has in common with the query"""
+        postings = [self.postings[self.starts[t]:self.starts[t+1]]
+                    for t in (self.vocabulary.get(token) for token in set(query_tokens)) if t is not None]
+        postings.append(np.zeros(0, dtype=np.int64))
+        return np.bincount(np.concatenate(postings), minlength=len(self))
+
+    def ratio(self, text: str, buckets: Buckets, selected: np.ndarray) -> np.ndarray:
+        """Return ratio of `text` to selected strings (in form given by `buckets`), 0 for the rest"""
+        a = to_matrix([text], len(text))
+        result = np.zeros(len(self))
+        for n, (b, ids) in buckets.items():
+            columns = np.flatnonzero(selected[ids])
+            if len(columns):
+                lcs = lcs_length_cdist(a, b[:, columns])[0]
+                result[ids[columns]] = indel_ratio(lcs, len(text) + n)
+        return result
+
+    def partial_ratio(self, text: str, buckets: Buckets, selected: np.ndarray) -> np.ndarray:
+        """Return partial ratio of `text` to selected strings (in form given by `buckets`), 0 for the rest"""
+        m = len(text)
+        a = to_matrix([text], m)
+        result = np.zeros(len(self))
+        for n, (b, ids) in buckets.items():
+            columns = np.flatnonzero(selected[ids])
+            if len(columns) == 0:
+                continue
+            b = b[:, columns]
+            best = np.zeros(len(columns))
+            if m <= n:
+                # parts of the strings against the query
+                parts, lengths = windows(b, m)
+                lcs = lcs_length_cdist(a, parts.reshape(m, -1))[0].reshape(len(lengths), len(columns))
+                best = indel_ratio(lcs, m + lengths[:, np.newaxis]).max(axis=0)
+            if n <= m:
+                # strings against parts of the query (both ways if the lengths are the same)
+                parts, lengths = windows(a, n)
+                lcs = lcs_length_cdist(parts.reshape(n, -1), b)
+                best = np.maximum(best, indel_ratio(lcs, n + lengths[:, np.newaxis]).max(axis=0))
+            result[ids[columns]] = best
+        return result
+
+    def token_set_ratio_shared(self, query_set: List[str], ids: np.ndarray) -> np.ndarray:
+        """Return token set ratio for strings with some tokens in common with the query, but not a subset"""
+        query_set_lookup = set(query_set)
+        diffs: Dict[str, List[Tuple[int, str, int]]] = {}  # diff_ab -> (position, diff_ba, length of intersection)
+        for position, i in enumerate(ids.tolist()):
+            string_set = set(self.token_sets[i])
+            intersection = [t for t in self.token_sets[i] if t in query_set_lookup]
+            diff_ab = " ".join(t for t in query_set if t not in string_set)
+            diff_ba = " ".join(t for t in self.token_sets[i] if t not in query_set_lookup)
+            diffs.setdefault(diff_ab, []).append((position, diff_ba, len(" ".join(intersection))))
+
+        result = np.zeros(len(ids))
+        for diff_ab, items in diffs.items():
+            a = to_matrix([diff_ab], len(diff_ab))
+            for n, group in itertools.groupby(sorted(items, key=lambda item: len(item[1])), key=lambda item: len(item[1])):
+                group = list(group)
+                positions = np.asarray([item[0] for item in group])
+                sect_len = np.asarray([item[2] for item in group])
+                lcs = lcs_length_cdist(a, to_matrix([item[1] for item in group], n))[0]
+                ab_len, ba_len = len(diff_ab), n
+                sect_ab_len, sect_ba_len = sect_len + 1 + ab_len, sect_len + 1 + ba_len
+                # "sect diff_ab" vs "sect diff_ba", and each of them vs "sect"
+                result[positions] = np.maximum.reduce([
+                    100.0 - 100.0 * (ab_len + ba_len - 2*lcs) / (sect_ab_len + sect_ba_len),
+                    100.0 - 100.0 * (1 + ab_len) / (sect_len + sect_ab_len),
+                    100.0 - 100.0 * (1 + ba_len) / (sect_len + sect_ba_len),
+                ])
+        return result
+
+    def scores(self, query: str) -> np.ndarray:
+        """Return WRatio of the query to each string, in [0, 100]"""
+        q = default_process(query)
+        if not q:
+            return np.zeros(len(self))
+        m = len(q)
+        query_tokens = q.split()
+        query_set = sorted(set(query_tokens))
+        query_sorted, query_set_joined = " ".join(sorted(query_tokens)), " ".join(query_set)
+
+        lengths = self.lengths
+        valid = lengths > 0
+        len_ratio = np.maximum(lengths, m) / np.maximum(np.minimum(lengths, m), 1)
+        short = valid & (len_ratio < 1.5)
+        long = valid & ~short
+        shared = self.shared_tokens(query_tokens)
+
+        result = self.ratio(q, self.processed, valid)
+
+        # strings of similar length: token sort ratio and token set ratio
+        token_ratio = self.ratio(query_sorted, self.sorted_tokens, short)
+        no_shared = short & (shared == 0)
+        token_ratio = np.maximum(token_ratio, self.ratio(query_set_joined, self.set_tokens, no_shared))
+        subset = short & (shared > 0) & ((shared == len(query_set)) | (shared == self.set_sizes))
+        token_ratio[subset] = 100.0
+        partly_shared = np.flatnonzero(short & (shared > 0) & ~subset)
+        if len(partly_shared):
+            token_ratio[partly_shared] = np.maximum(token_ratio[partly_shared],
+                                                    self.token_set_ratio_shared(query_set, partly_shared))
+        result = np.where(short, np.maximum(result, UNBASE_SCALE * token_ratio), result)
+
+        # strings of different length: partial ratio and partial token ratio
+        partial_scale = np.where(len_ratio <= 8.0, 0.9, 0.6)
+        partial = self.partial_ratio(q, self.processed, long)
+        partial_token = self.partial_ratio(query_sorted, self.sorted_tokens, long & (shared == 0))
+        duplicates = long & (shared == 0) & (self.has_duplicates | (len(query_tokens) != len(query_set)))
+        if duplicates.any():
+            partial_token = np.maximum(partial_token, self.partial_ratio(query_set_joined, self.set_tokens, duplicates))
+        partial_token[long & (shared > 0)] = 100.0
+        result = np.where(long, np.maximum.reduce([result, partial_scale * partial,
+                                                   UNBASE_SCALE * partial_scale * partial_token]), result)
+        return result
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[float, str]]:
+        """Return `limit` best (score, city) pairs by WRatio"""
+        scores = self.scores(query)
+        top = np.argpartition(scores, -limit)[-limit:] if len(scores) > limit else np.arange(len(scores))
+        top = np.flatnonzero(scores >= scores[top].min()) if len(top) else top
+        return sorted(((float(scores[i]), self.strings[i]) for i in top), reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query fuzzy search index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build index file from CSV dataset")
+    build_parser.add_argument("csv_path")
+    build_parser.add_argument("index_path")
+    build_parser.add_argument("--column", default="place15nm")
+    search_parser = subparsers.add_parser("search", help="search index file")
+    search_parser.add_argument("index_path")
+    search_parser.add_argument("input_text")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = FuzzyIndex.build(read_cities(args.csv_path, args.column))
+        index.save(args.index_path)
+        print(f"Saved {len(index)} strings in {len(index.len_to_mat)} buckets into {args.index_path}")
+    else:
+        t0 = timer()
+        index = FuzzyIndex.load(args.index_path)
+        t1 = timer()
+        results = search_levenshtein_banded(args.input_text, index.len_to_cities, index.len_to_mat)
+        t2 = timer()
+        for score, city in results:
+            print(f"{city:60}{score:3.2f}")
+        print(f"\nloaded in {1e3*(t1-t0):.1f} ms, searched in {1e3*(t2-t1):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()